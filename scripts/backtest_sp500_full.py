@@ -6,7 +6,10 @@ Same method, same RS=20, honest comparison.
 import os
 import sys
 import json
-from datetime import datetime
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
 import numpy as np
@@ -14,179 +17,337 @@ import pandas as pd
 import yfinance as yf
 
 sys.path.insert(0, str(Path(__file__).parent))
-from pipeline import SECTOR_HOLDINGS, BENCHMARK
+from pipeline import SECTOR_HOLDINGS_FALLBACK as SECTOR_HOLDINGS, BENCHMARK
+from pipeline import LAGGING, IMPROVING, WEAKENING, LEADING
+from pipeline import ACTIVE, CONFIRMED, REVERSED, EXPIRED, CLOSE_REASONS as REASONS
+from pipeline import njit, prange  # Numba when installed, plain Python otherwise
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache"
+PRICE_CACHE_TTL = 20 * 3600  # seconds — reuse prices within the same trading day
+CONSTITUENTS_TTL = 7 * 86400  # index changes a few times a year
+
+HISTORY_COLUMNS = ["ticker", "open_date", "open_price", "spy_open", "return_abs",
+                   "return_vs_spy", "days", "status", "reason"]
 
 # ── Get full S&P 500 list from Wikipedia ──
-def get_sp500_tickers():
-    """Fetch current S&P 500 constituents from Wikipedia."""
-    import urllib.request
+def get_sp500_tickers(max_retries=3):
+    """Fetch current S&P 500 constituents from Wikipedia, cached for a week."""
+    path = CACHE_DIR / "sp500_constituents.json"
+    if path.exists() and time.time() - path.stat().st_mtime < CONSTITUENTS_TTL:
+        return json.loads(path.read_text())
+
+    import requests
+    from io import StringIO
     url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-    req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-    with urllib.request.urlopen(req) as resp:
-        html = resp.read().decode()
-    tables = pd.read_html(html)
+    for attempt in range(1, max_retries + 1):
+        try:
+            resp = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10)
+            resp.raise_for_status()
+            break
+        except requests.RequestException as e:
+            if attempt == max_retries:
+                if path.exists():
+                    print(f"  Wikipedia unreachable ({e}), using stale {path.name}")
+                    return json.loads(path.read_text())
+                raise
+            wait = 2 ** attempt
+            print(f"  Wikipedia attempt {attempt} failed: {e}. Retrying in {wait}s...")
+            time.sleep(wait)
+    tables = pd.read_html(StringIO(resp.text))
     df = tables[0]
     tickers = df["Symbol"].str.replace(".", "-", regex=False).tolist()
+    CACHE_DIR.mkdir(exist_ok=True)
+    path.write_text(json.dumps(tickers))
     return tickers
 
 
-def compute_phase_series(stock_close, spy_close, period=20):
-    """Full phase series for one stock vs SPY. Returns (phases, rm_series)."""
-    rs = stock_close / spy_close
-    rs_sma = rs.rolling(period).mean()
-    rr = (rs / rs_sma) * 100
-    rm = (rr / rr.shift(period)) * 100
-    valid = rm.dropna().index
-    if len(valid) == 0:
-        return pd.Series(dtype=str), pd.Series(dtype=float)
-    rr_v = rr.loc[valid]
-    rm_v = rm.loc[valid]
-    result = pd.Series("lagging", index=valid)
-    result[(rr_v >= 100) & (rm_v >= 100)] = "leading"
-    result[(rr_v >= 100) & (rm_v < 100)] = "weakening"
-    result[(rr_v < 100) & (rm_v >= 100)] = "improving"
-    return result, rm
-
-
-def run_backfill(close, spy, tickers, label):
-    """Run backfill on a set of tickers. Returns history list."""
-    # Compute phase series + RS-Momentum
-    phase_series = {}
-    rm_series = {}
-    skipped = 0
-    for ticker in tickers:
-        if ticker not in close.columns:
-            skipped += 1
-            continue
-        c = close[ticker].dropna()
-        if len(c) < 80:
-            skipped += 1
-            continue
-        common = c.index.intersection(spy.index)
-        c = c.loc[common]
-        s = spy.loc[common]
-        if len(c) < 80:
-            skipped += 1
-            continue
-        ps, rm = compute_phase_series(c, s, 20)
-        if len(ps) > 20:
-            phase_series[ticker] = ps
-            rm_series[ticker] = rm
-
-    print(f"  {label}: {len(phase_series)} stocks with data, {skipped} skipped")
-
-    # Replay — use all available days after 50-day warmup
+# ── Download closes in chunks ──
+def download_close(tickers, period="2y", chunk_size=20, max_retries=3):
+    """Adjusted closes for `tickers`, fetched in chunks with per-chunk retries.
+
+    Chunks run one after another: concurrent yf.download calls share
+    module-level state in yfinance, so parallelism is left to its own
+    per-ticker threads inside each call. A chunk that keeps failing is
+    dropped instead of sinking the whole download.
+
+    Returns (close, dropped): dropped lists the tickers of failed chunks,
+    empty when the download is complete. Raises RuntimeError if nothing
+    was downloaded or the benchmark is missing.
+    """
+    frames = []
+    dropped = []
+    chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+    for n, chunk in enumerate(chunks, 1):
+        for attempt in range(1, max_retries + 1):
+            try:
+                data = yf.download(chunk, period=period, progress=False,
+                                   auto_adjust=True, threads=True)
+                if data.empty:
+                    raise RuntimeError("yfinance returned empty data")
+                close = data["Close"]
+                if isinstance(close, pd.Series):
+                    close = close.to_frame(chunk[0])
+                frames.append(close)
+                break
+            except Exception as e:
+                if attempt < max_retries:
+                    wait = 2 ** attempt
+                    print(f"  Chunk {n}/{len(chunks)} attempt {attempt} failed: {e}. "
+                          f"Retrying in {wait}s...")
+                    time.sleep(wait)
+                else:
+                    print(f"  Chunk {n}/{len(chunks)} skipped after {max_retries} attempts: {e}")
+                    dropped.extend(chunk)
+    if not frames:
+        raise RuntimeError(f"All {len(chunks)} download chunks failed")
+    close = pd.concat(frames, axis=1)
+    close = close.loc[:, ~close.columns.duplicated()]
+    if BENCHMARK not in close.columns or close[BENCHMARK].isna().all():
+        raise RuntimeError(f"No {BENCHMARK} prices downloaded, cannot run the backtest")
+    return close, dropped
+
+
+def load_close(tickers, period="2y"):
+    """download_close behind an on-disk cache keyed by (tickers, period).
+
+    Returns (close, dropped) like download_close. Incomplete downloads
+    are not cached, so the next run fetches again.
+    """
+    key = hashlib.md5((",".join(sorted(tickers)) + "|" + period).encode()).hexdigest()[:16]
+    path = CACHE_DIR / f"prices_{key}.pkl"
+    if path.exists() and time.time() - path.stat().st_mtime < PRICE_CACHE_TTL:
+        print(f"  Using cached prices ({path.name})")
+        return pd.read_pickle(path), []
+    close, dropped = download_close(tickers, period=period)
+    if dropped:
+        print(f"  {len(dropped)} tickers manquants, prix non mis en cache")
+        return close, dropped
+    CACHE_DIR.mkdir(exist_ok=True)
+    close.to_pickle(path)
+    return close, dropped
+
+
+def _rolling_mean(arr, period):
+    """Trailing `period` mean via cumsum, NaN for the first period-1 values.
+
+    Matches pandas .rolling(period).mean() up to float rounding (~1e-13
+    relative on two years of price ratios).
+    """
+    out = np.full_like(arr, np.nan)
+    if len(arr) >= period:
+        c = np.cumsum(arr)
+        out[period - 1:] = c[period - 1:]
+        out[period:] -= c[:-period]
+        out[period - 1:] /= period
+    return out
+
+
+def compute_phase_series(stock_arr, spy_arr, period=20):
+    """Full phase series for one stock vs SPY on aligned float arrays.
+
+    Returns (phases, rm): int8 phase codes from pipeline (LAGGING..LEADING,
+    -1 during warmup) and RS-Momentum. Strings only appear in the output.
+    """
+    rs = stock_arr / spy_arr
+    rr = rs / _rolling_mean(rs, period) * 100
+    rm = np.full_like(rr, np.nan)
+    rm[period:] = rr[period:] / rr[:-period] * 100
+    mom_up = rm >= 100
+    phases = np.where(rr >= 100,
+                      np.where(mom_up, LEADING, WEAKENING),
+                      np.where(mom_up, IMPROVING, LAGGING)).astype(np.int8)
+    phases[np.isnan(rm)] = -1
+    return phases, rm
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _scan_signals(phases, rm, day_ord, start, max_days):
+    """Replay the signal state machine per ticker over a (days x tickers) phase matrix.
+
+    Opens on entry into improving (RS-Mom >= 101), closes on any other phase or
+    after `max_days` calendar days. Returns (open_t, close_t, reason, count):
+    row k holds the first count[k] signals of ticker k; close_t is the last
+    replayed day for signals still active.
+    """
+    n_days, n_tickers = phases.shape
+    cap = n_days // 2 + 1
+    open_t = np.empty((n_tickers, cap), np.int64)
+    close_t = np.empty((n_tickers, cap), np.int64)
+    reason = np.empty((n_tickers, cap), np.int8)
+    count = np.zeros(n_tickers, np.int64)
+    for k in prange(n_tickers):
+        prev = -1
+        active = -1
+        n = 0
+        for t in range(n_days):
+            p = phases[t, k]
+            if p < 0:
+                continue
+            if t >= start:
+                if active < 0 and p == IMPROVING and prev >= 0 and prev != IMPROVING \
+                        and rm[t, k] >= 101:
+                    active = t
+                    open_t[k, n] = t
+                if active >= 0:
+                    close_t[k, n] = t
+                    if p != IMPROVING:
+                        reason[k, n] = CONFIRMED if p == LEADING else REVERSED
+                        active = -1
+                        n += 1
+                    elif day_ord[t] - day_ord[active] > max_days:
+                        reason[k, n] = EXPIRED
+                        active = -1
+                        n += 1
+            prev = p
+        if active >= 0:
+            reason[k, n] = ACTIVE
+            n += 1
+        count[k] = n
+    return open_t, close_t, reason, count
+
+
+def _ticker_phases(col, spy_arr):
+    """Phase codes + RS-Momentum for one aligned close row, or None if too short.
+
+    Returns (pos, phases, rm) with pos the trading-day rows the stock traded.
+    """
+    pos = np.flatnonzero(~np.isnan(col))
+    if len(pos) < 80:
+        return None
+    ps, rm = compute_phase_series(col[pos], spy_arr[pos], 20)
+    return pos, ps, rm
+
+
+def precompute_phases(close, spy, tickers):
+    """Phase codes + RS-Momentum for every ticker with enough data.
+
+    Returns {ticker: (pos, phases, rm)} where pos are the integer rows of
+    spy's trading days; computed once and shared by all backtest universes.
+    """
+    # Align once on SPY's trading days; per ticker it is then a NaN mask.
+    # float64 throughout: the >= 100 / >= 101 phase thresholds are exact tests
     trading_days = spy.dropna().index
-    start_idx = max(0, 50)
-    replay = trading_days[start_idx:]
+    spy_arr = spy.loc[trading_days].to_numpy(np.float64)
+    rows = close.reindex(index=trading_days, columns=tickers).to_numpy(np.float64).T.copy()
+    # Pure NumPy per ticker, so threads scale
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 2)) as ex:
+        results = list(ex.map(_ticker_phases, rows, repeat(spy_arr)))
+    return {t: res for t, res in zip(tickers, results)
+            if res is not None and (res[1] >= 0).sum() > 20}
 
-    history = []
-    active = {}
 
-    for day in replay:
-        date_str = day.strftime("%Y-%m-%d")
-        spy_price = float(spy.loc[day])
+def run_backfill(close, spy, tickers, label, phases=None):
+    """Run backfill on a set of tickers. Returns the signals as a DataFrame.
 
-        for ticker in phase_series:
-            ps = phase_series[ticker]
-            if day not in ps.index:
-                continue
-            phase_today = ps.loc[day]
-            day_pos = ps.index.get_loc(day)
-            if day_pos == 0:
-                continue
-            phase_yesterday = ps.iloc[day_pos - 1]
-
-            # New signal (RS-Momentum >= 101 filter)
-            if phase_today == "improving" and phase_yesterday != "improving":
-                rm_val = rm_series[ticker].loc[day] if day in rm_series[ticker].index else 100
-                if rm_val < 101:
-                    continue
-                if ticker not in active and ticker in close.columns:
-                    price = float(close[ticker].loc[day])
-                    if not np.isnan(price):
-                        active[ticker] = {
-                            "ticker": ticker,
-                            "open_date": date_str,
-                            "open_price": price,
-                            "spy_open": spy_price,
-                            "return_abs": 0.0,
-                            "return_vs_spy": 0.0,
-                            "days": 0,
-                            "status": "active",
-                            "reason": None,
-                        }
-                        history.append(active[ticker])
-
-            # Update
-            if ticker in active:
-                sig = active[ticker]
-                price = float(close[ticker].loc[day])
-                if not np.isnan(price):
-                    sig["return_abs"] = round(price / sig["open_price"] - 1, 5)
-                    sig["return_vs_spy"] = round(
-                        sig["return_abs"] - (spy_price / sig["spy_open"] - 1), 5
-                    )
-                open_dt = datetime.strptime(sig["open_date"], "%Y-%m-%d")
-                sig["days"] = (day.to_pydatetime().replace(tzinfo=None) - open_dt).days
-
-                if phase_today == "leading":
-                    sig["status"] = "closed"
-                    sig["reason"] = "confirmed"
-                    del active[ticker]
-                elif phase_today in ("weakening", "lagging"):
-                    sig["status"] = "closed"
-                    sig["reason"] = "reversed"
-                    del active[ticker]
-                elif sig["days"] > 30:
-                    sig["status"] = "closed"
-                    sig["reason"] = "expired"
-                    del active[ticker]
-
-    return history
+    `phases` is an optional precompute_phases() result covering `tickers`.
+    """
+    if phases is None:
+        phases = precompute_phases(close, spy, tickers)
+    names = [t for t in tickers if t in phases]
+    skipped = len(tickers) - len(names)
+
+    print(f"  {label}: {len(names)} stocks with data, {skipped} skipped")
+
+    # Replay — use all available days after 50-day warmup
+    trading_days = spy.dropna().index
+    start_idx = max(0, 50)
+    if not names:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+    # Phase / RS-Momentum matrices (days x tickers), -1 = no phase that day.
+    # Scattered by precomputed row positions, no per-ticker index alignment.
+    n_days = len(trading_days)
+    phase_mat = np.full((n_days, len(names)), -1, dtype=np.int8)
+    rm = np.full((n_days, len(names)), np.nan)
+    for j, t in enumerate(names):
+        pos, ps, r = phases[t]
+        phase_mat[pos, j] = ps
+        rm[pos, j] = r
+    close_mat = close.reindex(index=trading_days, columns=names).to_numpy(np.float64)
+    spy_arr = spy.loc[trading_days].to_numpy(np.float64)
+    # Calendar-day numbers for holding periods (straight from the datetime64
+    # values, wall-clock dates if tz-aware), date strings formatted once
+    wall_days = trading_days if trading_days.tz is None else trading_days.tz_localize(None)
+    day_ord = wall_days.values.astype("datetime64[D]").astype(np.int64)
+    date_strs = trading_days.strftime("%Y-%m-%d").to_numpy()
+
+    open_t, close_t, reason, count = _scan_signals(phase_mat, rm, day_ord, start_idx, 30)
+    filled = np.arange(open_t.shape[1]) < count[:, None]
+    k = np.nonzero(filled)[0]
+    t0, t1, reason = open_t[filled], close_t[filled], reason[filled]
+    order = np.lexsort((k, t0))
+    t0, k, t1, reason = t0[order], k[order], t1[order], reason[order]
+
+    open_price, spy_open = close_mat[t0, k], spy_arr[t0]
+    return_abs = np.round(close_mat[t1, k] / open_price - 1, 5)
+    return_vs_spy = np.round(return_abs - (spy_arr[t1] / spy_open - 1), 5)
+    days = day_ord[t1] - day_ord[t0]
+
+    # Columnar result straight from the kernel arrays, no per-signal dicts
+    return pd.DataFrame({
+        "ticker": np.asarray(names, dtype=object)[k],
+        "open_date": date_strs[t0],
+        "open_price": open_price,
+        "spy_open": spy_open,
+        "return_abs": return_abs,
+        "return_vs_spy": return_vs_spy,
+        "days": days,
+        "status": np.where(reason == ACTIVE, "active", "closed"),
+        "reason": np.asarray(REASONS, dtype=object)[reason],
+    }, columns=HISTORY_COLUMNS)
+
+
+def subset_history(history, tickers, label, phases):
+    """Signals of `history` for `tickers` only, as run_backfill would order them.
+
+    Signals are per ticker, so a universe's backtest is a filter of the
+    union's: same rows, sorted by open date then position in `tickers`.
+    """
+    rank = {t: i for i, t in enumerate(tickers)}
+    n = sum(t in phases for t in rank)
+    print(f"  {label}: {n} stocks with data, {len(tickers) - n} skipped")
+    rows = history[history["ticker"].isin(list(rank))]
+    order = rows["ticker"].map(rank)
+    return (rows.assign(_rank=order)
+                .sort_values(["open_date", "_rank"], kind="stable")
+                .drop(columns="_rank")
+                .reset_index(drop=True))
 
 
 def print_stats(history, label):
-    """Print clean comparison stats."""
-    closed = [s for s in history if s["status"] == "closed"]
-    act = [s for s in history if s["status"] == "active"]
-    if not closed:
+    """Print clean comparison stats for a run_backfill() frame."""
+    closed = history[history["status"] == "closed"]
+    n_closed = len(closed)
+    if not n_closed:
         print(f"  {label}: aucun signal clos")
         return
+    n_active = int((history["status"] == "active").sum())
 
-    wins_abs = [s for s in closed if s["return_abs"] > 0]
-    wins_spy = [s for s in closed if s["return_vs_spy"] > 0]
-    confirmed = [s for s in closed if s["reason"] == "confirmed"]
-    reversed_ = [s for s in closed if s["reason"] == "reversed"]
+    wins_abs = int((closed["return_abs"] > 0).sum())
+    wins_spy = int((closed["return_vs_spy"] > 0).sum())
+    avg_abs = closed["return_abs"].mean() * 100
+    avg_spy = closed["return_vs_spy"].mean() * 100
 
-    avg_abs = sum(s["return_abs"] for s in closed) / len(closed) * 100
-    avg_spy = sum(s["return_vs_spy"] for s in closed) / len(closed) * 100
-
-    conf_ret = sum(s["return_abs"] for s in confirmed) / max(1, len(confirmed)) * 100
-    conf_days = sum(s["days"] for s in confirmed) / max(1, len(confirmed))
-    rev_ret = sum(s["return_abs"] for s in reversed_) / max(1, len(reversed_)) * 100
-    rev_days = sum(s["days"] for s in reversed_) / max(1, len(reversed_))
+    by_reason = closed.groupby("reason").agg(
+        n=("return_abs", "size"), avg_ret=("return_abs", "mean"), avg_days=("days", "mean")
+    ).reindex(["confirmed", "reversed"]).fillna(0)
+    conf, rev = by_reason.loc["confirmed"], by_reason.loc["reversed"]
 
     print(f"\n  {'='*55}")
     print(f"  {label}")
     print(f"  {'='*55}")
-    print(f"  Signaux: {len(history)} total ({len(act)} actifs, {len(closed)} clos)")
-    print(f"  Win rate absolu:   {len(wins_abs):4d}/{len(closed)} = {len(wins_abs)/len(closed)*100:.1f}%")
-    print(f"  Win rate vs SPY:   {len(wins_spy):4d}/{len(closed)} = {len(wins_spy)/len(closed)*100:.1f}%")
+    print(f"  Signaux: {len(history)} total ({n_active} actifs, {n_closed} clos)")
+    print(f"  Win rate absolu:   {wins_abs:4d}/{n_closed} = {wins_abs/n_closed*100:.1f}%")
+    print(f"  Win rate vs SPY:   {wins_spy:4d}/{n_closed} = {wins_spy/n_closed*100:.1f}%")
     print(f"  Return moy abs:    {avg_abs:+.2f}%")
     print(f"  Return moy vs SPY: {avg_spy:+.2f}%")
-    print(f"  Confirmed: {len(confirmed)} ({len(confirmed)/len(closed)*100:.0f}%) "
-          f"ret {conf_ret:+.2f}% en {conf_days:.1f}j")
-    print(f"  Reversed:  {len(reversed_)} ({len(reversed_)/len(closed)*100:.0f}%) "
-          f"ret {rev_ret:+.2f}% en {rev_days:.1f}j")
+    print(f"  Confirmed: {int(conf.n)} ({conf.n/n_closed*100:.0f}%) "
+          f"ret {conf.avg_ret*100:+.2f}% en {conf.avg_days:.1f}j")
+    print(f"  Reversed:  {int(rev.n)} ({rev.n/n_closed*100:.0f}%) "
+          f"ret {rev.avg_ret*100:+.2f}% en {rev.avg_days:.1f}j")
 
 
 def main():
-    import shutil
-    cache = os.path.expanduser("~/Library/Caches/py-yfinance")
-    if os.path.exists(cache):
-        shutil.rmtree(cache)
-
     # Get tickers
     print("Fetching S&P 500 list from Wikipedia...")
     sp500_all = get_sp500_tickers()
@@ -204,24 +365,30 @@ def main():
     # Download ALL
     all_tickers = list(set(sp500_all + our_209 + [BENCHMARK]))
     print(f"\nDownloading {len(all_tickers)} tickers (2 years)...")
-    data = yf.download(all_tickers, period="2y", progress=False, auto_adjust=True)
-    close = data["Close"]
+    close, dropped = load_close(all_tickers, period="2y")
     spy = close[BENCHMARK]
     print(f"  Data: {len(close.columns)} columns, {len(close)} rows")
+    if dropped:
+        print(f"  ATTENTION: {len(dropped)} tickers non telecharges, resultats incomplets "
+              f"({', '.join(sorted(dropped))})")
+
+    # One replay over the union; each universe is a ticker subset of it
+    union = [t for t in all_tickers if t != BENCHMARK]
+    phases = precompute_phases(close, spy, union)
+    h_all = run_backfill(close, spy, union, "union", phases)
 
     # Run backtests
     print("\n--- Backtest 1: Our 209 stocks ---")
-    h_209 = run_backfill(close, spy, our_209, "209 stocks")
+    h_209 = subset_history(h_all, our_209, "209 stocks", phases)
     print_stats(h_209, "NOS 209 STOCKS (top 15-20/secteur)")
 
     print("\n--- Backtest 2: Full S&P 500 ---")
-    h_500 = run_backfill(close, spy, sp500_all, "500 stocks")
+    h_500 = subset_history(h_all, sp500_all, "500 stocks", phases)
     print_stats(h_500, "S&P 500 COMPLET (~500 stocks)")
 
     print("\n--- Backtest 3: Les ~290 qu'on n'a PAS ---")
-    h_rest = run_backfill(close, spy, sp500_rest, "rest")
+    h_rest = subset_history(h_all, sp500_rest, "rest", phases)
     print_stats(h_rest, "LES ~290 STOCKS QU'ON N'A PAS")
 
-
 if __name__ == "__main__":
     main()
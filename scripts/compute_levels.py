@@ -7,14 +7,17 @@ downloads OHLCV data, computes technical levels using 7 methods, scores them,
 and saves results to data/levels.json.
 """
 
-import json
 import os
+import sys
 import glob
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-import yfinance as yf
 from datetime import datetime, timedelta
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pipeline import _read_json, _write_json  # orjson when installed, atomic writes
+
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECTORS_DIR = os.path.join(BASE_DIR, "data", "sectors")
@@ -35,9 +38,11 @@ def find_gold_stocks():
     Returns tickers that are currently in an active GOLD trade.
     """
     gold = {}
-    for path in sorted(glob.glob(os.path.join(SECTORS_DIR, "*_history.json"))):
-        with open(path) as f:
-            data = json.load(f)
+    paths = sorted(glob.glob(os.path.join(SECTORS_DIR, "*_history.json")))
+    # Files are read and parsed on a few threads, then replayed in order
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        histories = list(pool.map(_read_json, paths))
+    for path, data in zip(paths, histories):
         sector = data.get("sector_name", os.path.basename(path).replace("_history.json", ""))
         dates = data.get("dates", [])
         for ticker, info in data.get("stocks", {}).items():
@@ -82,6 +87,8 @@ def find_gold_stocks():
 
 def download_ohlcv(tickers, period="1y"):
     """Download 1 year of daily OHLCV for a list of tickers (batch of 10 max)."""
+    import yfinance as yf  # only needed when downloading
+
     all_data = {}
     batch_size = 10
     for i in range(0, len(tickers), batch_size):
@@ -535,8 +542,7 @@ def main():
         print("  No stocks in GOLD position found.")
         # Write empty result
         result = {"date": today, "stocks": {}}
-        with open(OUTPUT_FILE, "w") as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
+        _write_json(OUTPUT_FILE, result, indent=True)
         print(f"\nEmpty result saved to {OUTPUT_FILE}")
         return
 
@@ -577,8 +583,7 @@ def main():
         "date": today,
         "stocks": results,
     }
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    _write_json(OUTPUT_FILE, output, indent=True)
     print(f"  Saved {len(results)} stocks to {OUTPUT_FILE}")
     print()
     print("Done.")
@@ -13,12 +13,16 @@ Position tracking:
 Outputs data/signals.json.
 """
 
-import json
+import argparse
 import os
+import sys
 import datetime
+import hashlib
+import time
 import numpy as np
-import pandas as pd
-import yfinance as yf
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pipeline import _read_json, _write_json  # orjson when installed, atomic writes
 
 SECTORS = {
     "XLK":  "Technologie",
@@ -44,6 +48,8 @@ REPO_ROOT = os.path.dirname(SCRIPT_DIR)
 DATA_DIR = os.path.join(REPO_ROOT, "data")
 POSITIONS_FILE = os.path.join(DATA_DIR, "positions.json")
 SIGNALS_FILE = os.path.join(DATA_DIR, "signals.json")
+CACHE_DIR = os.path.join(REPO_ROOT, ".cache")
+PRICE_CACHE_TTL = 3600  # seconds — reruns within the hour reuse today's download
 
 SIGNAL_LABELS = {
     "R1": "Underperf Cyclique",
@@ -60,15 +66,20 @@ SIGNAL_LABELS = {
 }
 
 
-def download_data():
-    """Download 1 year of OHLCV data for all sector ETFs + SPY."""
-    import shutil, time
+def clear_yfinance_cache():
+    """Delete yfinance's on-disk caches (only on --clear-cache)."""
+    import shutil
     for _cache_dir in [
         os.path.expanduser("~/Library/Caches/py-yfinance"),
         os.path.expanduser("~/.cache/py-yfinance"),
     ]:
         if os.path.exists(_cache_dir):
             shutil.rmtree(_cache_dir)
+
+
+def download_data():
+    """Download 1 year of OHLCV data for all sector ETFs + SPY."""
+    import yfinance as yf  # only needed when downloading
     end = datetime.date.today()
     start = end - datetime.timedelta(days=400)
     for attempt in range(1, 4):
@@ -86,6 +97,28 @@ def download_data():
                 raise
 
 
+def load_data(refresh=False):
+    """download_data behind an on-disk pickle keyed by (day, tickers).
+
+    Files from earlier days are deleted when a new one is written;
+    refresh=True skips the cached file.
+    """
+    import pandas as pd  # only needed to read the cached frame
+    day = datetime.date.today().isoformat()
+    key = hashlib.md5(",".join(sorted(ALL_TICKERS)).encode()).hexdigest()[:16]
+    path = os.path.join(CACHE_DIR, f"signals_{day}_{key}.pkl")
+    if not refresh and os.path.exists(path) and time.time() - os.path.getmtime(path) < PRICE_CACHE_TTL:
+        print(f"  Using cached prices ({os.path.basename(path)})")
+        return pd.read_pickle(path)
+    data = download_data()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith("signals_") and not name.startswith(f"signals_{day}_"):
+            os.remove(os.path.join(CACHE_DIR, name))
+    data.to_pickle(path)
+    return data
+
+
 def compute_rsi(series, period=14):
     """RSI via SMA method."""
     delta = series.diff()
@@ -100,28 +133,27 @@ def compute_rsi(series, period=14):
 def compute_cmf(high, low, close, volume, period=21):
     """Chaikin Money Flow."""
     mfm = ((close - low) - (high - close)) / (high - low)
-    mfm = mfm.replace([np.inf, -np.inf], 0).fillna(0)
+    mfm = mfm.where(np.isfinite(mfm), 0.0)  # flat bars (inf) and gaps (NaN) -> 0, one pass
     mfv = mfm * volume
     return mfv.rolling(period).sum() / volume.rolling(period).sum()
 
 
 def compute_outflow_streak(cmf):
-    """Consecutive days where CMF < 0."""
+    """Consecutive days where CMF < 0 (per column for a DataFrame)."""
     negative = (cmf < 0).astype(int)
-    groups = negative.ne(negative.shift()).cumsum()
-    return negative.groupby(groups).cumsum()
+    # Running count of negative days, minus its value at the last non-negative day
+    count = negative.cumsum()
+    return count - count.where(negative == 0, 0).cummax()
 
 
 def load_positions():
     if os.path.exists(POSITIONS_FILE):
-        with open(POSITIONS_FILE) as f:
-            return json.load(f)
+        return _read_json(POSITIONS_FILE)
     return {}
 
 
 def save_positions(positions):
-    with open(POSITIONS_FILE, "w") as f:
-        json.dump(positions, f, indent=2)
+    _write_json(POSITIONS_FILE, positions, indent=True)
 
 
 def get_signals(data):
@@ -132,29 +164,25 @@ def get_signals(data):
     volume = data["Volume"]
     spy_close = close[BENCHMARK]
 
-    # Precompute indicators
-    rel_ret_20d, rel_ret_60d, rel_ret_120d = {}, {}, {}
-    rsi_vals, cmf_vals, outflow_streaks = {}, {}, {}
-    ma50_vals, dist_ma50, vol_60d = {}, {}, {}
-
-    spy_ret_20d = spy_close.pct_change(20)
-    spy_ret_60d = spy_close.pct_change(60)
-    spy_ret_120d = spy_close.pct_change(120)
-
-    for ticker in SECTORS:
-        c, h, l, v = close[ticker], high[ticker], low[ticker], volume[ticker]
-        rel_ret_20d[ticker] = c.pct_change(20) - spy_ret_20d
-        rel_ret_60d[ticker] = c.pct_change(60) - spy_ret_60d
-        rel_ret_120d[ticker] = c.pct_change(120) - spy_ret_120d
-        rsi_vals[ticker] = compute_rsi(c)
-        cmf_vals[ticker] = compute_cmf(h, l, c, v)
-        outflow_streaks[ticker] = compute_outflow_streak(cmf_vals[ticker])
-        ma50_vals[ticker] = c.rolling(50).mean()
-        dist_ma50[ticker] = (c - ma50_vals[ticker]) / ma50_vals[ticker]
-        vol_60d[ticker] = c.pct_change().rolling(60).std() * np.sqrt(252) * 100
+    # Precompute indicators — returns, MA50 and 60d volatility for all sectors
+    # at once (one rolling pass per frame instead of one per ticker)
+    sector_close = close[list(SECTORS)]
+    rel_ret_20d = sector_close.pct_change(20).sub(spy_close.pct_change(20), axis=0)
+    rel_ret_60d = sector_close.pct_change(60).sub(spy_close.pct_change(60), axis=0)
+    rel_ret_120d = sector_close.pct_change(120).sub(spy_close.pct_change(120), axis=0)
+    ma50_vals = sector_close.rolling(50).mean()
+    dist_ma50 = (sector_close - ma50_vals) / ma50_vals
+    vol_60d = sector_close.pct_change().rolling(60).std() * np.sqrt(252) * 100
+
+    # RSI, CMF and outflow streaks the same way: the indicator functions are
+    # column-wise, so each runs once on the (days x sectors) frames
+    rsi_vals = compute_rsi(sector_close)
+    cmf_vals = compute_cmf(high[list(SECTORS)], low[list(SECTORS)], sector_close,
+                           volume[list(SECTORS)])
+    outflow_streaks = compute_outflow_streak(cmf_vals)
 
     # Cross-sector metrics
-    all_60d_rets = pd.DataFrame({t: rel_ret_60d[t] for t in SECTORS})
+    all_60d_rets = rel_ret_60d
     # Drop rows where all values are NaN to avoid idxmin crash on weekends/holidays
     all_60d_rets = all_60d_rets.dropna(how="all")
     dispersion = all_60d_rets.std(axis=1)
@@ -169,29 +197,38 @@ def get_signals(data):
     latest = close.index[-1]
     date_str = latest.strftime("%Y-%m-%d")
 
+    # Latest values that don't depend on the sector, read once
+    last_close = close.iloc[-1].to_numpy(dtype=float)
+    col_idx = {t: i for i, t in enumerate(close.columns)}
+    disp_now = dispersion.iloc[-1]
+    disp_thresh = disp_90pct.iloc[-1]
+    worst_now = worst_sector.iloc[-1]
+    def_cyc_spread = def_avg.iloc[-1] - cyc_avg.iloc[-1]
+    # Last row of each per-sector frame (columns in SECTORS order), read once
+    (rr60_now, rr20_now, rr120_now, rsi_now, cmf_now, streak_now, dma50_now,
+     ma50_now, vol_now) = (frame.iloc[-1].to_numpy() for frame in (
+        rel_ret_60d, rel_ret_20d, rel_ret_120d, rsi_vals, cmf_vals, outflow_streaks,
+        dist_ma50, ma50_vals, vol_60d))
+
     positions = load_positions()
     results = []
 
-    for ticker, name in SECTORS.items():
+    for i, (ticker, name) in enumerate(SECTORS.items()):
         signals = {}
         buy_count, sell_count = 0, 0
 
-        rr60 = rel_ret_60d[ticker].iloc[-1]
-        rr20 = rel_ret_20d[ticker].iloc[-1]
-        rr120 = rel_ret_120d[ticker].iloc[-1]
-        rsi = rsi_vals[ticker].iloc[-1]
-        cmf = cmf_vals[ticker].iloc[-1]
-        streak = outflow_streaks[ticker].iloc[-1]
-        dma50 = dist_ma50[ticker].iloc[-1]
-        current_price = float(close[ticker].iloc[-1])
-        ma50_price = float(ma50_vals[ticker].iloc[-1])
+        rr60 = rr60_now[i]
+        rr20 = rr20_now[i]
+        rr120 = rr120_now[i]
+        rsi = rsi_now[i]
+        cmf = cmf_now[i]
+        streak = streak_now[i]
+        dma50 = dma50_now[i]
+        current_price = float(last_close[col_idx[ticker]])
+        ma50_price = float(ma50_now[i])
         price_below_ma50 = current_price < ma50_price
         price_above_ma50 = current_price > ma50_price
-        vol = vol_60d[ticker].iloc[-1]
-        disp_now = dispersion.iloc[-1]
-        disp_thresh = disp_90pct.iloc[-1]
-        worst_now = worst_sector.iloc[-1]
-        def_cyc_spread = def_avg.iloc[-1] - cyc_avg.iloc[-1]
+        vol = vol_now[i]
 
         # --- 8 BUY SIGNALS ---
         r1 = rr60 < -0.10 and ticker in CYCLICALS
@@ -325,14 +362,20 @@ def get_signals(data):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Sector rotation signals")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="Purge the yfinance caches and re-download prices")
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        clear_yfinance_cache()
     print("Downloading sector data...")
-    data = download_data()
+    data = load_data(refresh=args.clear_cache)
     print("Computing signals...")
     output = get_signals(data)
 
     os.makedirs(DATA_DIR, exist_ok=True)
-    with open(SIGNALS_FILE, "w") as f:
-        json.dump(output, f, indent=2)
+    _write_json(SIGNALS_FILE, output, indent=True)
 
     print(f"\nSignals -> {SIGNALS_FILE}")
     print(f"Date: {output['date']}")
@@ -9,15 +9,81 @@ import json
 import sys
 import os
 import argparse
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
+from operator import itemgetter
 from pathlib import Path
 
 import numpy as np
 
+# Compiled kernels persist next to the download cache, so a kept .cache/
+# skips the JIT warm-up on later runs (cache=True on every @njit).
+os.environ.setdefault(
+    "NUMBA_CACHE_DIR", str(Path(__file__).resolve().parent.parent / ".cache" / "numba"))
+
+try:
+    from numba import njit, prange
+except ImportError:  # plain Python fallback, same results
+    prange = range
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
 # Heavy imports deferred — only needed for live mode
 pd = None
 yf = None
 
+
+def _require_pandas():
+    """Import pandas on first use; --sample never reaches a caller."""
+    global pd
+    if pd is None:
+        import pandas
+        pd = pandas
+    return pd
+
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback; it writes NaN as NaN where orjson writes null
+    orjson = None
+
+
+def _json_bytes(obj, indent=False):
+    """Serialize `obj` to JSON bytes (orjson when installed, else the json module)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0))
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+
+def _write_atomic(path, *chunks):
+    """Write byte chunks to a temp file next to `path`, then rename it into place.
+
+    Readers (the frontend, the next run) never see a truncated file.
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.writelines(chunks)
+    os.replace(tmp, path)
+
+
+def _write_json(path, obj, indent=False):
+    """Write `obj` as JSON to `path`."""
+    _write_atomic(path, _json_bytes(obj, indent))
+
+
+def _read_json(path):
+    """Parse the JSON file at `path`; orjson's decode error subclasses json's."""
+    if orjson is not None:
+        return orjson.loads(Path(path).read_bytes())
+    with open(path) as f:
+        return json.load(f)
+
 # ---------------------------------------------------------------------------
 # S&P 500 Sector ETFs (11 GICS sectors)
 # ---------------------------------------------------------------------------
@@ -37,6 +103,8 @@ SECTOR_ETFS = {
 
 SECTOR_ORDER = list(SECTOR_ETFS.keys())
 BENCHMARK = "SPY"
+ETF_TICKERS = SECTOR_ORDER + [BENCHMARK]  # what fetch_ohlcv downloads
+SECTOR_NAMES = {etf: meta["name"] for etf, meta in SECTOR_ETFS.items()}
 
 # Mapping GICS sector names → sector ETF tickers
 GICS_TO_ETF = {
@@ -89,7 +157,7 @@ def get_sp500_tickers():
         resp = requests.get(url, headers=headers, timeout=15)
         resp.raise_for_status()
         from io import StringIO
-        tables = pd.read_html(StringIO(resp.text))
+        tables = _require_pandas().read_html(StringIO(resp.text))
         df = tables[0]
         holdings = {etf: [] for etf in SECTOR_ETFS}
         for _, row in df.iterrows():
@@ -104,8 +172,7 @@ def get_sp500_tickers():
         project_root = Path(__file__).resolve().parent.parent
         cache_file = project_root / "data" / "sp500_tickers_cache.json"
         cache_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(cache_file, "w") as f:
-            json.dump(holdings, f)
+        _write_json(cache_file, holdings)
         return holdings
     except Exception as e:
         print(f"Wikipedia scrape failed: {e}, trying fallback...")
@@ -148,11 +215,38 @@ def _download_with_retry(tickers, max_retries=3, **kwargs):
                 raise RuntimeError(f"yfinance failed after {max_retries} attempts: {e}")
 
 
-def fetch_ohlcv(period: str = "2y"):
-    """Download OHLCV data for all sector ETFs + SPY benchmark."""
-    tickers = list(SECTOR_ETFS.keys()) + [BENCHMARK]
-    print(f"Downloading {len(tickers)} ETFs ({period})...")
-    return _download_with_retry(tickers, period=period)
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache"
+PRICE_CACHE_TTL = 3600  # seconds — reruns within the hour reuse today's download
+
+
+def _download_cached(tickers, period="2y"):
+    """_download_with_retry behind an on-disk pickle keyed by (day, tickers, period).
+
+    Files from earlier days are deleted when a new one is written.
+    """
+    day = datetime.now().strftime("%Y-%m-%d")
+    key = hashlib.md5((",".join(sorted(tickers)) + "|" + period).encode()).hexdigest()[:16]
+    path = CACHE_DIR / f"ohlcv_{day}_{key}.pkl"
+    if path.exists() and _time.time() - path.stat().st_mtime < PRICE_CACHE_TTL:
+        print(f"  Using cached prices ({path.name})")
+        return _require_pandas().read_pickle(path)
+    data = _download_with_retry(tickers, period=period)
+    CACHE_DIR.mkdir(exist_ok=True)
+    for old in CACHE_DIR.glob("ohlcv_*.pkl"):
+        if not old.name.startswith(f"ohlcv_{day}_"):
+            old.unlink()
+    data.to_pickle(path)
+    return data
+
+
+def fetch_ohlcv(period: str = "2y", extra_tickers=()):
+    """Download OHLCV data for all sector ETFs + SPY benchmark.
+
+    `extra_tickers` (e.g. the sector holdings) come along in the same call.
+    """
+    extra = sorted(set(extra_tickers) - set(ETF_TICKERS))
+    print(f"Downloading {len(ETF_TICKERS)} ETFs + {len(extra)} stocks ({period})...")
+    return _download_cached(ETF_TICKERS + extra, period=period)
 
 
 # ---------------------------------------------------------------------------
@@ -160,16 +254,49 @@ def fetch_ohlcv(period: str = "2y"):
 # ---------------------------------------------------------------------------
 PHASE_CONFIRM_DAYS = 5  # Must stay in new quadrant for N days to confirm
 
+# Integer phase codes: bit 1 = RS-Ratio >= 100, bit 0 = RS-Momentum >= 100
+LAGGING, IMPROVING, WEAKENING, LEADING = 0, 1, 2, 3
+PHASE_NAMES = ("lagging", "improving", "weakening", "leading")
+
+# Signal outcome codes written by the replay kernels
+ACTIVE, CONFIRMED, REVERSED, EXPIRED = 0, 1, 2, 3
+CLOSE_REASONS = (None, "confirmed", "reversed", "expired")
+
 def classify_phase(rs_ratio, rs_momentum):
-    """Raw phase from RS-Ratio / RS-Momentum quadrant."""
-    if rs_ratio >= 100 and rs_momentum >= 100:
-        return "leading"
-    elif rs_ratio < 100 and rs_momentum >= 100:
-        return "improving"
-    elif rs_ratio >= 100 and rs_momentum < 100:
-        return "weakening"
-    else:
-        return "lagging"
+    """Raw phase from RS-Ratio / RS-Momentum quadrant ("lagging" if either is NaN)."""
+    known = (rs_ratio == rs_ratio) * (rs_momentum == rs_momentum)
+    return PHASE_NAMES[((rs_ratio >= 100) * 2 + (rs_momentum >= 100)) * known]
+
+
+def phase_codes(rs_ratio, rs_momentum):
+    """Vectorized classify_phase: int8 phase codes for arrays of RS-Ratio / RS-Momentum."""
+    return ((np.asarray(rs_ratio) >= 100) * 2 + (np.asarray(rs_momentum) >= 100)).astype(np.int8)
+
+
+@njit(cache=True, nogil=True)
+def _smooth_codes(codes, confirm_days):
+    """smooth_phase_series state machine over an int8 phase-code array (-1 = no pending)."""
+    out = np.empty_like(codes)
+    confirmed = codes[0]
+    pending = -1
+    pending_count = 0
+    out[0] = confirmed
+    for i in range(1, len(codes)):
+        raw = codes[i]
+        if raw == confirmed:
+            pending = -1
+            pending_count = 0
+        elif raw == pending:
+            pending_count += 1
+            if pending_count >= confirm_days:
+                confirmed = pending
+                pending = -1
+                pending_count = 0
+        else:
+            pending = raw
+            pending_count = 1
+        out[i] = confirmed
+    return out
 
 
 def smooth_phase_series(raw_phases, confirm_days=PHASE_CONFIRM_DAYS):
@@ -180,14 +307,17 @@ def smooth_phase_series(raw_phases, confirm_days=PHASE_CONFIRM_DAYS):
     the previous phase is maintained.
 
     Args:
-        raw_phases: list/array of raw phase strings
+        raw_phases: list/array of raw phases (int codes or strings);
+            an int8 code array (phase_codes output) runs the compiled kernel
         confirm_days: number of consecutive days required to confirm
 
     Returns:
-        list of smoothed phase strings (same length)
+        list of smoothed phases (same length)
     """
     if len(raw_phases) == 0:
         return []
+    if isinstance(raw_phases, np.ndarray) and raw_phases.dtype == np.int8:
+        return _smooth_codes(raw_phases, confirm_days).tolist()
 
     smoothed = [raw_phases[0]]
     confirmed = raw_phases[0]
@@ -213,97 +343,369 @@ def smooth_phase_series(raw_phases, confirm_days=PHASE_CONFIRM_DAYS):
     return smoothed
 
 
+def _smooth_code_array(codes):
+    """smooth_phase_series for an int8 code array, kept as an int8 array."""
+    return _smooth_codes(codes, PHASE_CONFIRM_DAYS) if len(codes) else codes
+
+
+def _phase_streak(smoothed):
+    """(days_in_phase, previous_phase) for the run of equal phases ending the series.
+
+    The last phase change is found directly (first difference) instead of
+    comparing the whole reversed series to the final phase.
+    """
+    changes = np.flatnonzero(np.diff(smoothed))
+    if len(changes) == 0:
+        return len(smoothed), None
+    last = int(changes[-1])
+    return len(smoothed) - 1 - last, smoothed[last]
+
+
 # ---------------------------------------------------------------------------
 # Indicator calculations
 # ---------------------------------------------------------------------------
-def compute_rsi_series(close, period=14):
-    """RSI series for a stock."""
-    delta = close.diff()
-    gain = delta.where(delta > 0, 0).rolling(period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(period).mean()
-    rs = gain / loss.replace(0, np.nan)
-    return 100 - 100 / (1 + rs)
-
-
-def compute_mfi(high, low, close, volume, period=14):
-    """Money Flow Index (latest value)."""
-    tp = (high + low + close) / 3
-    rmf = tp * volume
-    delta = tp.diff()
-    pos = (rmf * (delta > 0)).rolling(period).sum()
-    neg = (rmf * (delta < 0)).abs().rolling(period).sum()
-    ratio = pos / neg.replace(0, np.nan)
-    mfi = 100 - 100 / (1 + ratio)
-    val = mfi.iloc[-1]
-    return float(val) if not np.isnan(val) else 50.0
-
-
-def compute_cmf(high, low, close, volume, period=21):
-    """Chaikin Money Flow (latest value)."""
-    hl_range = high - low
-    hl_range = hl_range.replace(0, np.nan)
-    mfm = ((close - low) - (high - close)) / hl_range
-    mfv = mfm * volume
-    cmf = mfv.rolling(period).sum() / volume.rolling(period).sum()
-    val = cmf.iloc[-1]
-    return float(val) if not np.isnan(val) else 0.0
-
-
-def compute_rs(close, benchmark, period=20):
-    """JdK RS-Ratio and RS-Momentum. Returns current + 5-day-ago values."""
-    rs = close / benchmark
-    rs_sma = rs.rolling(period).mean()
-    rs_ratio = (rs / rs_sma) * 100
-    rs_mom = (rs_ratio / rs_ratio.shift(period)) * 100
-    r = rs_ratio.iloc[-1]
-    m = rs_mom.iloc[-1]
+@njit(cache=True, nogil=True)
+def _gain_loss_means(packed, period):
+    """Rolling `period` means of RSI gains and losses down each column of packed closes.
+
+    Follows pandas' rolling().mean() step for step — Kahan-compensated running
+    sum with separate compensation for added and removed values, the
+    flat-window and sign clamps — so results match the pandas SMA RSI bit for
+    bit. All columns advance together, one row at a time. Returns (T, 2N):
+    gains, then losses (-0.0 on non-down days, as -delta.where(delta < 0, 0)).
+    """
+    T, N = packed.shape
+    delta = packed[1:] - packed[:-1]
+    x = np.empty((T, 2 * N))
+    x[0, :N] = 0.0
+    x[0, N:] = -0.0
+    x[1:, :N] = np.where(delta > 0, delta, 0.0)
+    x[1:, N:] = np.where(delta < 0, -delta, -0.0)
+    total = np.zeros(2 * N)
+    comp_add = np.zeros(2 * N)
+    comp_rem = np.zeros(2 * N)
+    n_neg = np.zeros(2 * N)
+    n_same = np.zeros(2 * N)
+    prev = x[0].copy()
+    means = np.full((T, 2 * N), np.nan)
+    for t in range(T):
+        if t >= period:
+            v = x[t - period]
+            y = -v - comp_rem
+            s = total + y
+            comp_rem = s - total - y
+            total = s
+            n_neg = n_neg - np.signbit(v)
+        v = x[t]
+        y = v - comp_add
+        s = total + y
+        comp_add = s - total - y
+        total = s
+        n_neg = n_neg + np.signbit(v)
+        n_same = np.where(v == prev, n_same + 1, 1.0)
+        prev = v
+        if t >= period - 1:
+            m = total / period
+            m = np.where((n_neg == 0) & (m < 0), 0.0, m)
+            m = np.where((n_neg == period) & (m > 0), 0.0, m)
+            means[t] = np.where(n_same >= period, prev, m)
+    return means
+
+
+def compute_rsi_batch(close, period=14):
+    """SMA RSI series for each column of a (T, N) close array, over the column's own closes.
+
+    Gaps are dropped before the rolling windows and the values put back on
+    their rows; NaN on rows without a close.
+    """
+    out = np.full(close.shape, np.nan)
+    if len(close) == 0:
+        return out
+    own = ~np.isnan(close)
+    order = np.argsort(~own, axis=0, kind="stable")  # each column's own rows first
+    means = _gain_loss_means(np.take_along_axis(close, order, axis=0), period)
+    gain, loss = means[:, :close.shape[1]], means[:, close.shape[1]:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = gain / loss
+    rs[loss == 0] = np.nan
+    rsi = 100 - 100 / (1 + rs)
+    rsi[np.arange(len(close))[:, None] >= own.sum(axis=0)] = np.nan
+    np.put_along_axis(out, order, rsi, axis=0)
+    return out
+
+
+@njit(cache=True, nogil=True)
+def _flow_last(high, low, close, volume, mfi_period, cmf_period):
+    """MFI and CMF over their last windows in one pass down each column.
+
+    Running pos/neg money-flow sums for MFI and mfv/volume sums for CMF are
+    accumulated from the same bar reads.
+    """
+    T, N = close.shape
+    mfi = np.full(N, 50.0)
+    cmf = np.zeros(N)
+    do_mfi = T >= mfi_period
+    do_cmf = T >= cmf_period
+    start = T - max(mfi_period + 1 if do_mfi else 0, cmf_period if do_cmf else 0)
+    start = max(start, 0)
+    for j in range(N):
+        pos = 0.0
+        neg = 0.0
+        tp_prev = np.nan
+        mfv_sum = 0.0
+        vol_sum = 0.0
+        for t in range(start, T):
+            h, l, c, v = high[t, j], low[t, j], close[t, j], volume[t, j]
+            if do_mfi and t >= T - mfi_period - 1:
+                tp = (h + l + c) / 3
+                if t >= T - mfi_period:
+                    rmf = tp * v
+                    delta = tp - tp_prev
+                    pos += rmf * (1.0 if delta > 0 else 0.0)
+                    neg += abs(rmf * (1.0 if delta < 0 else 0.0))
+                tp_prev = tp
+            if do_cmf and t >= T - cmf_period:
+                hl_range = h - l
+                mfm = ((c - l) - (h - c)) / hl_range if hl_range != 0 else np.nan
+                mfv_sum += mfm * v
+                vol_sum += v
+        if do_mfi and neg != 0 and not np.isnan(pos) and not np.isnan(neg):
+            mfi[j] = 100 - 100 / (1 + pos / neg)
+        if do_cmf and vol_sum != 0 and not np.isnan(mfv_sum) and not np.isnan(vol_sum):
+            cmf[j] = mfv_sum / vol_sum
+    return mfi, cmf
+
+
+def compute_flow_batch(high, low, close, volume, mfi_period=14, cmf_period=21):
+    """(MFI, CMF) latest values for each column of (T, N) arrays.
+
+    A gap in the MFI window reports the neutral 50; flat bars (high == low)
+    or gaps in the CMF window report 0.
+    """
+    return _flow_last(high, low, close, volume, mfi_period, cmf_period)
+
+
+def _rolling_mean_2d(x, period):
+    """Trailing `period` mean down each column; NaN unless the whole window is valid."""
+    valid = ~np.isnan(x)
+    zero = np.zeros((1, x.shape[1]))
+    sums = np.concatenate([zero, np.cumsum(np.where(valid, x, 0.0), axis=0)])
+    counts = np.concatenate([zero, np.cumsum(valid, axis=0)])
+    out = np.full(x.shape, np.nan)
+    if len(x) >= period:
+        win_sum = sums[period:] - sums[:-period]
+        win_n = counts[period:] - counts[:-period]
+        out[period - 1:] = np.where(win_n == period, win_sum / period, np.nan)
+    return out
+
+
+def compute_rs_series_batch(close, benchmark, period=20):
+    """JdK RS-Ratio / RS-Momentum series for each column of a (T, N) close array.
+
+    `benchmark` is one (T,) series shared by all columns, or (T, N) per column.
+    """
+    rs = close / (benchmark if benchmark.ndim == 2 else benchmark[:, None])
+    rr = rs / _rolling_mean_2d(rs, period) * 100
+    rm = np.full(rr.shape, np.nan)
+    rm[period:] = rr[period:] / rr[:-period] * 100
+    return rr, rm
+
+
+def compute_sector_rs(data):
+    """Full-history RS-Ratio / RS-Momentum frames of every sector ETF vs the benchmark.
+
+    Computed once in main() and shared by detect_rotations and
+    generate_sector_history, which both need the same series.
+    """
+    close = data["Close"][SECTOR_ORDER].dropna(axis=1, how="all")
+    rr, rm = compute_rs_series_batch(close.to_numpy(dtype=np.float64),
+                                     data["Close"][BENCHMARK].to_numpy(dtype=np.float64))
+    frame = _require_pandas().DataFrame
+    return (frame(rr, index=close.index, columns=close.columns),
+            frame(rm, index=close.index, columns=close.columns))
+
+
+def compute_holdings_rs(data_all, sector_holdings):
+    """Full-history RS-Ratio / RS-Momentum frames of each sector's holdings vs its ETF.
+
+    {etf: (rr, rm)}, computed once in main() and shared by compute_sector_detail
+    and backfill_signal_history, which both start from the same series.
+    """
+    close = data_all["Close"]
+    frame = _require_pandas().DataFrame
+    # One batch for every sector: each holding column runs against its own
+    # ETF column, and the rolling math is per column, so sectors do not mix
+    groups = []
+    for etf, holdings in sector_holdings.items():
+        cols = [t for t in dict.fromkeys(holdings) if t in close.columns]
+        if etf in close.columns and cols:
+            groups.append((etf, cols))
+    if not groups:
+        return {}
+    stock_cols = [t for _, cols in groups for t in cols]
+    etf_cols = [etf for etf, cols in groups for _ in cols]
+    rr, rm = compute_rs_series_batch(close[stock_cols].to_numpy(dtype=np.float64),
+                                     close[etf_cols].to_numpy(dtype=np.float64))
+    holdings_rs = {}
+    start = 0
+    for etf, cols in groups:
+        part = slice(start, start + len(cols))
+        holdings_rs[etf] = (frame(rr[:, part], index=close.index, columns=cols),
+                            frame(rm[:, part], index=close.index, columns=cols))
+        start += len(cols)
+    return holdings_rs
+
+
+def _is_contiguous(mask):
+    """Per column of a (T, N) bool mask: are the True rows one unbroken block?"""
+    n = mask.sum(axis=0)
+    first = mask.argmax(axis=0)
+    last = len(mask) - 1 - mask[::-1].argmax(axis=0)
+    return (n > 0) & (n == last - first + 1)
+
+
+def _phase_value(rs_ratio, rs_momentum):
+    """Phase value 0-100 — composite of RS-Ratio + RS-Momentum (vectorized)."""
+    return np.clip(((rs_ratio - 95) + (rs_momentum - 95)) / 20 * 100, 0, 100)
+
+
+def _rs_latest(rr, rm):
+    """(rs_ratio, rs_mom, rs_ratio_prev, rs_mom_prev) vectors from full RS series."""
     # Previous values (5 trading days ago) for trend
-    r_prev = rs_ratio.iloc[-6] if len(rs_ratio) >= 6 else r
-    m_prev = rs_mom.iloc[-6] if len(rs_mom) >= 6 else m
-    return (float(r) if not np.isnan(r) else 100.0,
-            float(m) if not np.isnan(m) else 100.0,
-            float(r_prev) if not np.isnan(r_prev) else 100.0,
-            float(m_prev) if not np.isnan(m_prev) else 100.0)
-
-
-def compute_trend(close, period=20):
-    """Signed R² linear regression on last N days."""
-    prices = close.values[-period:]
-    n = len(prices)
+    prev = -6 if len(rr) >= 6 else -1
+    return tuple(np.where(np.isnan(v), 100.0, v) for v in (rr[-1], rm[-1], rr[prev], rm[prev]))
+
+
+TENSOR_FIELDS = ("High", "Low", "Close", "Volume")
+
+
+def _valid_sectors(data):
+    """Sector ETFs (sorted) with at least one value in each of High/Low/Close/Volume.
+
+    One notna pass per field over the sector columns, instead of a dropna copy
+    of each frame and a set intersection of what is left.
+    """
+    present = np.logical_and.reduce(
+        [data[f][SECTOR_ORDER].notna().any(axis=0).to_numpy() for f in TENSOR_FIELDS])
+    return sorted(t for t, ok in zip(SECTOR_ORDER, present) if ok)
+
+
+def extract_float_tensor(data, tickers, dtype=np.float64):
+    """Stack High/Low/Close/Volume for `tickers` into one (4, T, N) array.
+
+    Field-major, so each field is a contiguous (T, N) block; missing
+    columns come back as NaN.
+    """
+    return np.stack([data[f].reindex(columns=tickers).to_numpy(dtype=dtype)
+                     for f in TENSOR_FIELDS])
+
+
+def _corr_matrix(x):
+    """Pearson correlation between the columns of a (T, N) array.
+
+    Closed form from raw sums: (n Σxy − Σx Σy) / sqrt((n Σx² − (Σx)²)(n Σy² − (Σy)²)),
+    with Σxy for all pairs from one matmul and no centred copy of x. With gaps,
+    the same sums are taken over the rows both columns share (pairwise-complete,
+    like pandas' .corr()) by weighting with the validity mask. Constant columns
+    and pairs with fewer than two shared rows give NaN.
+    """
+    gaps = np.isnan(x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if not gaps.any():
+            n = x.shape[0]
+            sx = x.sum(axis=0)
+            sxx = n * (x * x).sum(axis=0)
+            var = sxx - sx * sx
+            var[var <= sxx * 1e-12] = np.nan  # constant column: cancellation noise, not variance
+            return (n * (x.T @ x) - np.outer(sx, sx)) / np.sqrt(np.outer(var, var))
+
+        m = (~gaps).astype(np.float64)
+        x0 = np.where(gaps, 0.0, x)
+        n = m.T @ m                  # shared rows per pair
+        sx = x0.T @ m                # sx[i, j]: Σ x_i over rows shared with j
+        sxx = n * ((x0 * x0).T @ m)
+        var = sxx - sx * sx
+        var[(var <= sxx * 1e-12) | (n < 2)] = np.nan
+        return (n * (x0.T @ x0) - sx * sx.T) / np.sqrt(var * var.T)
+
+
+@njit(cache=True, nogil=True)
+def _trend_last(close, period):
+    """Signed R² of a least-squares line through the last `period` rows, per column.
+
+    All columns are regressed together: each pass walks the window row by row
+    and updates per-column accumulators, so reads follow the (T, N) layout.
+    """
+    T, N = close.shape
+    n = min(T, period)
+    out = np.zeros(N)
     if n < 5:
-        return 0.0
-    x = np.arange(n, dtype=float)
-    xm, ym = x.mean(), prices.mean()
-    ss_xy = ((x - xm) * (prices - ym)).sum()
-    ss_xx = ((x - xm) ** 2).sum()
-    if ss_xx == 0:
-        return 0.0
+        return out
+    # x-side terms depend only on the window length: computed once, not per column
+    xm = (n - 1) / 2
+    xd = np.arange(n) - xm
+    ss_xx = n * (n * n - 1) / 12  # sum of (k - xm)^2, exact for these small n
+    Y = close[T - n:]
+    ym = np.zeros(N)
+    for k in range(n):
+        for j in range(N):
+            ym[j] += Y[k, j]
+    ym /= n
+    ss_xy = np.zeros(N)
+    ss_tot = np.zeros(N)
+    for k in range(n):
+        for j in range(N):
+            dy = Y[k, j] - ym[j]
+            ss_xy[j] += xd[k] * dy
+            ss_tot[j] += dy * dy
     slope = ss_xy / ss_xx
-    y_pred = slope * x + (ym - slope * xm)
-    ss_res = ((prices - y_pred) ** 2).sum()
-    ss_tot = ((prices - ym) ** 2).sum()
-    if ss_tot == 0:
-        return 0.0
-    r2 = max(0.0, 1 - ss_res / ss_tot)
-    return float(r2) if slope > 0 else float(-r2)
+    intercept = ym - slope * xm
+    ss_res = np.zeros(N)
+    for k in range(n):
+        for j in range(N):
+            e = Y[k, j] - (slope[j] * k + intercept[j])
+            ss_res[j] += e * e
+    for j in range(N):
+        if ss_tot[j] == 0:
+            continue  # flat window
+        r2 = 1 - ss_res[j] / ss_tot[j]
+        r2 = r2 if r2 > 0 else 0.0  # also maps NaN (gap in the window) to 0
+        out[j] = r2 if slope[j] > 0 else -r2
+    return out
+
+
+def compute_trend_batch(close, period=20):
+    """Signed R² linear regression on last N days, for each column of a (T, N) array."""
+    return _trend_last(close, period)
+
+
+def _top_k(scores, k):
+    """Indices of the k largest scores, descending, ties in input order.
+
+    Same result as a stable full sort cut to k, but only the entries at or
+    above the k-th score (found by np.partition) get sorted.
+    """
+    if len(scores) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        cand = np.flatnonzero(scores >= kth)
+    else:
+        cand = np.arange(len(scores))
+    return cand[np.argsort(-scores[cand], kind="stable")[:k]]
 
 
 # ---------------------------------------------------------------------------
 # Rotation detection
 # ---------------------------------------------------------------------------
-def detect_rotations(data):
-    """Main rotation detection for 11 sector ETFs."""
-    etfs = list(SECTOR_ETFS.keys())
+def detect_rotations(data, sector_rs=None):
+    """Main rotation detection for 11 sector ETFs.
 
+    `sector_rs` is an optional compute_sector_rs(data) result to reuse.
+    """
     # Extract data
-    close = data["Close"][etfs].dropna(axis=1, how="all")
-    high = data["High"][etfs].dropna(axis=1, how="all")
-    low = data["Low"][etfs].dropna(axis=1, how="all")
-    volume = data["Volume"][etfs].dropna(axis=1, how="all")
     benchmark = data["Close"][BENCHMARK]
 
-    valid = sorted(set(close.columns) & set(high.columns) & set(low.columns) & set(volume.columns))
-    close, high, low, volume = close[valid], high[valid], low[valid], volume[valid]
+    valid = _valid_sectors(data)
+    volume = data["Volume"][valid]
     print(f"  Valid sector ETFs: {len(valid)}")
 
     # Detect partial trading day
@@ -313,145 +715,120 @@ def detect_rotations(data):
     if partial_day:
         print("  Partial trading day detected — using yesterday for indicators")
 
-    ind_close = close.iloc[:-1] if partial_day else close
-    ind_high = high.iloc[:-1] if partial_day else high
-    ind_low = low.iloc[:-1] if partial_day else low
-    ind_volume = volume.iloc[:-1] if partial_day else volume
-    ind_benchmark = benchmark.iloc[:-1] if partial_day else benchmark
+    # One (4, T, N) array for everything below; indicators skip a partial last bar
+    ohlcv = extract_float_tensor(data, valid)
+    close_arr = ohlcv[2]
+    H, L, C, V = ohlcv[:, :-1] if partial_day else ohlcv
+    bench_close = benchmark.to_numpy(dtype=np.float64)
 
     # Returns
-    returns = close.pct_change().iloc[1:]
-    bench_returns = benchmark.pct_change().iloc[1:]
-    common_idx = returns.index.intersection(bench_returns.index)
-    returns = returns.loc[common_idx]
-    bench_returns = bench_returns.loc[common_idx]
-
-    # Betas (60-day rolling)
-    market_var = bench_returns.rolling(60).var().iloc[-1]
-    betas = {}
-    for t in valid:
-        if market_var == 0 or np.isnan(market_var):
-            betas[t] = 1.0
-        else:
-            cov = returns[t].rolling(60).cov(bench_returns).iloc[-1]
-            betas[t] = float(cov / market_var) if not np.isnan(cov) else 1.0
-
-    # Residual returns (daily — kept for tooltip detail)
-    latest_returns = returns.iloc[-1]
-    latest_bench = bench_returns.iloc[-1]
-    residuals_daily = {t: float(latest_returns[t] - betas[t] * latest_bench) for t in valid}
-
-    # Multi-timeframe returns
-    ret_5d = {}
-    ret_20d = {}
-    bench_5d = float(benchmark.iloc[-1] / benchmark.iloc[-5] - 1) if len(benchmark) >= 5 else 0
-    bench_20d = float(benchmark.iloc[-1] / benchmark.iloc[-20] - 1) if len(benchmark) >= 20 else 0
-    residuals_5d = {}
-    residuals_20d = {}
-    for t in valid:
-        r5 = close[t].iloc[-1] / close[t].iloc[-5] - 1 if len(close) >= 5 else 0
-        r20 = close[t].iloc[-1] / close[t].iloc[-20] - 1 if len(close) >= 20 else 0
-        ret_5d[t] = float(r5) if not np.isnan(r5) else 0.0
-        ret_20d[t] = float(r20) if not np.isnan(r20) else 0.0
-        residuals_5d[t] = ret_5d[t] - betas[t] * bench_5d
-        residuals_20d[t] = ret_20d[t] - betas[t] * bench_20d
-
-    # Volume ratio
-    vol_avg = ind_volume.rolling(20).mean()
-    vol_ratio_all = {}
-    for t in valid:
-        v = ind_volume[t].iloc[-1] / vol_avg[t].iloc[-1]
-        vol_ratio_all[t] = float(v) if not np.isnan(v) and np.isfinite(v) else 1.0
-
-    # Per-sector indicators
-    nodes = []
-    indicators = {}
-    for t in valid:
-        meta = SECTOR_ETFS[t]
-        mfi = compute_mfi(ind_high[t], ind_low[t], ind_close[t], ind_volume[t])
-        cmf = compute_cmf(ind_high[t], ind_low[t], ind_close[t], ind_volume[t])
-        rs_ratio, rs_mom, rs_ratio_prev, rs_mom_prev = compute_rs(close[t], benchmark)
-        trend = compute_trend(ind_close[t], period=20)
-
-        indicators[t] = {"mfi": mfi, "cmf": cmf, "rs_ratio": rs_ratio, "rs_momentum": rs_mom}
-
-        # Phase value 0-100 — composite of RS-Ratio + RS-Momentum
-        phase_value = float(np.clip(((rs_ratio - 95) + (rs_mom - 95)) / 20 * 100, 0, 100))
-
-        # Phase trend: delta vs 5 days ago
-        phase_value_prev = float(np.clip(((rs_ratio_prev - 95) + (rs_mom_prev - 95)) / 20 * 100, 0, 100))
-        phase_delta = round(phase_value - phase_value_prev, 1)
-
-        # Smoothed phase: compute raw phase series, then apply confirmation filter
-        days_in_phase = 0
-        previous_phase = None
-        _rs = close[t] / benchmark
-        _rs_sma = _rs.rolling(20).mean()
-        _rr = (_rs / _rs_sma) * 100
-        _rm = (_rr / _rr.shift(20)) * 100
-        _raw_phases = []
-        _valid_idx = _rm.dropna().index
-        for _day in _valid_idx:
-            _raw_phases.append(classify_phase(float(_rr.loc[_day]), float(_rm.loc[_day])))
-
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret_arr = close_arr[1:] / close_arr[:-1] - 1
+        bench_arr = bench_close[1:] / bench_close[:-1] - 1
+
+    # Betas (last 60 days) — one centred matmul for all sectors; a window
+    # with any missing return gives NaN and falls back to beta 1.0
+    betas_arr = np.ones(len(valid))
+    if len(bench_arr) >= 60:
+        R = ret_arr[-60:]
+        bc = bench_arr[-60:] - bench_arr[-60:].mean()
+        market_var = bc @ bc / 59
+        cov = (R - R.mean(axis=0)).T @ bc / 59
+        if market_var != 0 and not np.isnan(market_var):
+            with np.errstate(invalid="ignore"):
+                betas_arr = np.where(np.isnan(cov), 1.0, cov / market_var)
+
+    latest_returns = ret_arr[-1]
+    latest_bench = float(bench_arr[-1])
+
+    # Multi-timeframe returns + 5d beta-adjusted residuals, one vector per horizon
+    bench_5d = float(bench_close[-1] / bench_close[-5] - 1) if len(bench_close) >= 5 else 0
+    ret_5d = close_arr[-1] / close_arr[-5] - 1 if len(close_arr) >= 5 else np.zeros(len(valid))
+    ret_20d = close_arr[-1] / close_arr[-20] - 1 if len(close_arr) >= 20 else np.zeros(len(valid))
+    ret_5d = np.where(np.isnan(ret_5d), 0.0, ret_5d)
+    ret_20d = np.where(np.isnan(ret_20d), 0.0, ret_20d)
+    residuals_5d = ret_5d - betas_arr * bench_5d
+
+    # Volume ratio: last bar vs its 20-day mean (only the last window is needed)
+    vol_avg = V[-20:].mean(axis=0) if len(V) >= 20 else np.full(len(valid), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vol_ratio_all = V[-1] / vol_avg
+    vol_ratio_all = np.where(np.isfinite(vol_ratio_all), vol_ratio_all, 1.0)
+
+    # Money flow for all sectors in one pass over the (T, N) arrays
+    mfi_arr, cmf_arr = compute_flow_batch(H, L, C, V)
+    trend_arr = compute_trend_batch(C, period=20)
+    # RS-Ratio / RS-Momentum series vs SPY for all sectors (full history, not ind_*)
+    if sector_rs is None:
+        rr_all, rm_all = compute_rs_series_batch(close_arr, bench_close)
+    else:
+        rr_all, rm_all = (f[valid].to_numpy() for f in sector_rs)
+    rr_now, rm_now, rr_prev, rm_prev = _rs_latest(rr_all, rm_all)
+    phase_value_now = _phase_value(rr_now, rm_now)
+    phase_value_prev = _phase_value(rr_prev, rm_prev)  # 5 days ago
+    # Raw phase codes for every sector and day in one op; rows without
+    # RS-Momentum are dropped per sector below
+    has_rs = ~np.isnan(rm_all)
+    raw_codes = phase_codes(rr_all, rm_all)
+
+    # Smoothed phase per sector: raw phase series, then confirmation filter
+    phases, streaks, previous = [], [], []
+    for i in range(len(valid)):
         # Apply smoothing on last 90 days (enough context for confirmation)
-        _raw_tail = _raw_phases[-90:] if len(_raw_phases) > 90 else _raw_phases
-        _smoothed = smooth_phase_series(_raw_tail)
-        phase = _smoothed[-1] if _smoothed else classify_phase(rs_ratio, rs_mom)
-
+        _smoothed = _smooth_code_array(raw_codes[has_rs[:, i], i][-90:])
+        phases.append(PHASE_NAMES[_smoothed[-1]] if len(_smoothed)
+                      else classify_phase(rr_now[i], rm_now[i]))
+        days_in_phase, previous_phase = 0, None
         if len(_smoothed) > 1:
-            current = _smoothed[-1]
-            count = 0
-            for k in range(len(_smoothed) - 1, -1, -1):
-                if _smoothed[k] == current:
-                    count += 1
-                else:
-                    break
-            days_in_phase = count
-            for k in range(len(_smoothed) - days_in_phase - 1, -1, -1):
-                if _smoothed[k] != current:
-                    previous_phase = _smoothed[k]
-                    break
-
+            days_in_phase, previous_code = _phase_streak(_smoothed)
+            previous_phase = PHASE_NAMES[previous_code] if previous_code is not None else None
+        streaks.append(days_in_phase)
+        previous.append(previous_phase)
+
+    # One node per sector, read from per-sector columns (Python floats via tolist)
+    records = zip(valid, latest_returns.tolist(), ret_5d.tolist(), ret_20d.tolist(),
+                  residuals_5d.tolist(), vol_ratio_all.tolist(), mfi_arr.tolist(),
+                  cmf_arr.tolist(), trend_arr.tolist(), phases, phase_value_now.tolist(),
+                  (phase_value_now - phase_value_prev).tolist(), rr_now.tolist(),
+                  rm_now.tolist(), streaks, previous)
+    nodes = []
+    for (t, daily_ret, r5, r20, resid, vol_ratio, mfi, cmf, trend, phase, phase_value,
+         phase_delta, rs_ratio, rs_mom, days_in_phase, previous_phase) in records:
+        meta = SECTOR_ETFS[t]
         nodes.append({
             "id": t,
             "name": meta["name"],
             "color": meta["color"],
             "weight": meta.get("weight", 5.0),
-            "daily_return": round(float(latest_returns[t]), 5),
-            "return_5d": round(ret_5d[t], 5),
-            "return_20d": round(ret_20d[t], 5),
-            "residual_return": round(residuals_5d[t], 5),
-            "volume_ratio": round(vol_ratio_all[t], 2),
+            "daily_return": round(daily_ret, 5),
+            "return_5d": round(r5, 5),
+            "return_20d": round(r20, 5),
+            "residual_return": round(resid, 5),
+            "volume_ratio": round(vol_ratio, 2),
             "mfi": round(mfi, 1),
             "cmf": round(cmf, 3),
             "trend": round(trend, 3),
             "momentum_phase": phase,
             "phase_value": round(phase_value, 1),
-            "phase_delta": phase_delta,
+            "phase_delta": round(phase_delta, 1),  # vs 5 days ago
             "rs_ratio": round(rs_ratio, 1),
             "rs_momentum": round(rs_mom, 1),
             "days_in_phase": days_in_phase,
             "previous_phase": previous_phase,
         })
 
-    # Market state — inter-sector correlation
-    beta_adj = pd.DataFrame(
-        bench_returns.values.reshape(-1, 1) * np.array([betas[t] for t in valid]).reshape(1, -1),
-        index=returns.index, columns=valid,
-    )
-    resid_returns = returns[valid] - beta_adj
-    recent_resid = resid_returns.tail(min(20, len(resid_returns) - 1))
-
-    if len(recent_resid.columns) > 1:
-        corr_matrix = recent_resid.corr()
-        mask = np.triu(np.ones_like(corr_matrix, dtype=bool), k=1)
-        upper = corr_matrix.where(mask).stack()
-        avg_corr = float(upper.mean()) if len(upper) > 0 else 0.0
-        if np.isnan(avg_corr):
-            avg_corr = 0.0
-    else:
-        avg_corr = 0.0
+    # Market state — inter-sector correlation of the last 20 beta-adjusted
+    # residuals (only those rows are built, not the full-history residuals)
+    n_recent = max(0, min(20, len(ret_arr) - 1))
+    start = len(ret_arr) - n_recent
+    recent_resid = ret_arr[start:] - bench_arr[start:, None] * betas_arr[None, :]
+
+    avg_corr = 0.0
+    if len(valid) > 1 and n_recent > 1:
+        upper = _corr_matrix(recent_resid)[np.triu_indices(len(valid), k=1)]
+        upper = upper[~np.isnan(upper)]
+        if len(upper) > 0:
+            avg_corr = float(upper.mean())
     market_state = "high_correlation" if avg_corr > 0.7 else "normal"
 
     # Narrative + regime
@@ -465,7 +842,7 @@ def detect_rotations(data):
             "market_state": market_state,
             "avg_correlation": round(avg_corr, 3),
             "total_sectors": len(valid),
-            "benchmark_return": round(float(latest_bench), 5),
+            "benchmark_return": round(latest_bench, 5),
             "regime": regime,
             "regime_label": regime_label,
             "regime_confidence": regime_confidence,
@@ -480,52 +857,65 @@ def detect_rotations(data):
 # ---------------------------------------------------------------------------
 REGIME_PROFILES = {
     "early_cycle": {
-        "leaders": {"XLF", "XLY", "XLI", "XLRE"},
-        "laggers": {"XLU", "XLV", "XLP"},
+        "leaders": frozenset({"XLF", "XLY", "XLI", "XLRE"}),
+        "laggers": frozenset({"XLU", "XLV", "XLP"}),
         "label": "Cycliques en tete",
         "context": "un schema typique de reprise economique",
     },
     "mid_cycle": {
-        "leaders": {"XLK", "XLC", "XLI", "XLY"},
-        "laggers": {"XLE", "XLU", "XLRE"},
+        "leaders": frozenset({"XLK", "XLC", "XLI", "XLY"}),
+        "laggers": frozenset({"XLE", "XLU", "XLRE"}),
         "label": "Croissance en tete",
         "context": "une configuration classique de phase d'expansion",
     },
     "late_cycle": {
-        "leaders": {"XLE", "XLV", "XLP", "XLU"},
-        "laggers": {"XLK", "XLY", "XLC"},
+        "leaders": frozenset({"XLE", "XLV", "XLP", "XLU"}),
+        "laggers": frozenset({"XLK", "XLY", "XLC"}),
         "label": "Defensives en tete",
         "context": "un positionnement historiquement associe aux fins de cycle",
     },
     "contraction": {
-        "leaders": {"XLU", "XLV", "XLP"},
-        "laggers": {"XLF", "XLI", "XLY", "XLK", "XLE"},
+        "leaders": frozenset({"XLU", "XLV", "XLP"}),
+        "laggers": frozenset({"XLF", "XLI", "XLY", "XLK", "XLE"}),
         "label": "Mode prudence",
         "context": "un repli vers les valeurs refuges",
     },
 }
 
+# Sector sets as bitmasks (one bit per ETF): set intersections become int ANDs
+_SECTOR_BIT = {t: 1 << i for i, t in enumerate(SECTOR_ORDER)}
+
+
+def _sector_mask(tickers):
+    mask = 0
+    for t in tickers:
+        mask |= _SECTOR_BIT[t]
+    return mask
+
+
+_REGIME_MASKS = {regime: (_sector_mask(p["leaders"]), _sector_mask(p["laggers"]),
+                          len(p["leaders"]) + len(p["laggers"]))
+                 for regime, p in REGIME_PROFILES.items()}
+
 
 def _detect_regime(nodes):
     """Infer market regime from sector rotation pattern."""
-    actual_leaders = {n["id"] for n in nodes
-                      if n["momentum_phase"] in ("leading", "improving")}
-    actual_laggers = {n["id"] for n in nodes
-                      if n["momentum_phase"] in ("lagging", "weakening")}
+    actual_leaders = actual_laggers = 0
+    for n in nodes:
+        if n["momentum_phase"] in ("leading", "improving"):
+            actual_leaders |= _SECTOR_BIT[n["id"]]
+        else:
+            actual_laggers |= _SECTOR_BIT[n["id"]]
 
     best_regime = None
     best_score = -999
     best_confidence = 0.0
 
-    for regime, profile in REGIME_PROFILES.items():
-        expected_leaders = profile["leaders"]
-        expected_laggers = profile["laggers"]
-        total = len(expected_leaders) + len(expected_laggers)
-
-        leader_matches = len(actual_leaders & expected_leaders)
-        lagger_matches = len(actual_laggers & expected_laggers)
-        leader_contra = len(actual_laggers & expected_leaders)
-        lagger_contra = len(actual_leaders & expected_laggers)
+    for regime, (expected_leaders, expected_laggers, total) in _REGIME_MASKS.items():
+        leader_matches = (actual_leaders & expected_leaders).bit_count()
+        lagger_matches = (actual_laggers & expected_laggers).bit_count()
+        leader_contra = (actual_laggers & expected_leaders).bit_count()
+        lagger_contra = (actual_leaders & expected_laggers).bit_count()
 
         score = leader_matches + lagger_matches - 0.5 * (leader_contra + lagger_contra)
         confidence = score / total if total > 0 else 0
@@ -613,93 +1003,97 @@ def _generate_narrative(nodes, rotations, market_state, avg_corr):
 # ---------------------------------------------------------------------------
 # Sample data (for testing without API)
 # ---------------------------------------------------------------------------
-def generate_sector_history(data, days=90):
-    """Generate historical RS-Ratio/RS-Momentum snapshots for RRG playback."""
-    etfs = list(SECTOR_ETFS.keys())
-    close = data["Close"][etfs].dropna(axis=1, how="all")
-    high = data["High"][etfs].dropna(axis=1, how="all")
-    low = data["Low"][etfs].dropna(axis=1, how="all")
-    volume = data["Volume"][etfs].dropna(axis=1, how="all")
+def _rounded(values, ndigits):
+    """Float array as a list of rounded Python floats, None for NaN.
+
+    Same values as round(x, ndigits) per element, without a round() call per
+    element: rint(x * 10**n) / 10**n is the correctly rounded result unless
+    x * 10**n lies next to a .5 tie (or is huge, inf or NaN), and only those
+    few elements go through round() itself.
+    """
+    x = np.asarray(values, dtype=np.float64)
+    scale = 10.0 ** ndigits
+    y = x * scale
+    out = (np.rint(y) / scale).tolist()
+    with np.errstate(invalid="ignore"):
+        odd = ~(np.abs(y) < 1e9) | (np.abs(y - np.floor(y) - 0.5) < 1e-6)
+    for i in np.flatnonzero(odd).tolist():
+        v = float(x[i])
+        out[i] = round(v, ndigits) if v == v else None
+    return out
+
+
+def _rounded_on(series, days, ndigits):
+    """Values of `series` on `days`, rounded, with None for missing/NaN days.
+
+    One reindex per series instead of a `.loc[day]` lookup per day.
+    """
+    return _rounded(series.reindex(days).to_numpy(), ndigits)
+
+
+def generate_sector_history(data, days=90, sector_rs=None):
+    """Generate historical RS-Ratio/RS-Momentum snapshots for RRG playback.
+
+    `sector_rs` is an optional compute_sector_rs(data) result to reuse.
+    """
     benchmark = data["Close"][BENCHMARK]
-    valid = sorted(set(close.columns) & set(high.columns) & set(low.columns) & set(volume.columns))
-
-    # Compute full RS series per sector
-    rs_full = {}
-    for t in valid:
-        rs = close[t] / benchmark
-        rs_sma = rs.rolling(20).mean()
-        rr = (rs / rs_sma) * 100
-        rm = (rr / rr.shift(20)) * 100
-        rs_full[t] = {"rr": rr, "rm": rm}
-
-    # Compute full CMF series per sector (21-day rolling)
-    cmf_full = {}
-    for t in valid:
-        hl_range = high[t] - low[t]
-        hl_range = hl_range.replace(0, np.nan)
-        mfm = ((close[t] - low[t]) - (high[t] - close[t])) / hl_range
-        mfv = mfm * volume[t]
-        cmf_series = mfv.rolling(21).sum() / volume[t].rolling(21).sum()
-        cmf_full[t] = cmf_series
-
-    # Compute 20-day return per sector (for Flow Map Y-axis)
-    ret_full = {}
-    for t in valid:
-        ret_full[t] = close[t].pct_change(20)
-
-    # Compute distance to 50-day MA per sector (for Signal Actif condition)
-    ma50_full = {}
-    for t in valid:
-        ma50 = close[t].rolling(50).mean()
-        ma50_full[t] = (close[t] / ma50) - 1  # negative = below MA50
+    valid = _valid_sectors(data)
+    close = data["Close"][valid]
+
+    # Full RS series for all sectors (shared with detect_rotations when given)
+    rr_full, rm_full = sector_rs if sector_rs is not None else compute_sector_rs(data)
+
+    # Compute full CMF series for all sectors at once (21-day rolling)
+    h, l, c, v = data["High"][valid], data["Low"][valid], close, data["Volume"][valid]
+    hl_range = h - l
+    mfv = ((c - l) - (h - c)) / hl_range.where(hl_range != 0) * v
+    cmf_full = mfv.rolling(21).sum() / v.rolling(21).sum()
+
+    # 20-day return per sector (for Flow Map Y-axis), all sectors in one pass
+    ret_full = c.pct_change(20)
+
+    # Distance to 50-day MA per sector (for Signal Actif condition)
+    ma50_full = (c / c.rolling(50).mean()) - 1  # negative = below MA50
 
     trading_days = benchmark.dropna().index[-days:]
     dates = [d.strftime("%Y-%m-%d") for d in trading_days]
 
+    # Raw phase codes and RS validity for the whole (T, N) panel in one op each
+    rr_panel = rr_full[valid].to_numpy()
+    rm_panel = rm_full[valid].to_numpy()
+    ok_panel = ~np.isnan(rr_panel) & ~np.isnan(rm_panel)
+    codes_panel = phase_codes(rr_panel, rm_panel)
+    day_rows = rr_full.index.get_indexer(trading_days)
+
     sectors = {}
-    for t in valid:
-        rr = rs_full[t]["rr"]
-        rm = rs_full[t]["rm"]
+    for i, t in enumerate(valid):
+        rr = rr_full[t]
+        rm = rm_full[t]
         cmf_s = cmf_full[t]
         ret_s = ret_full[t]
         ma50_s = ma50_full[t]
-        close_s = close[t]
-        r_vals = []
-        m_vals = []
-        c_vals = []
-        ret_vals = []
-        ma50_vals = []
-        close_vals = []
-        raw_phases = []
-        for day in trading_days:
-            r = float(rr.loc[day]) if day in rr.index and not np.isnan(rr.loc[day]) else None
-            m = float(rm.loc[day]) if day in rm.index and not np.isnan(rm.loc[day]) else None
-            c = float(cmf_s.loc[day]) if day in cmf_s.index and not np.isnan(cmf_s.loc[day]) else 0.0
-            ret = float(ret_s.loc[day]) if day in ret_s.index and not np.isnan(ret_s.loc[day]) else None
-            ma50d = float(ma50_s.loc[day]) if day in ma50_s.index and not np.isnan(ma50_s.loc[day]) else None
-            p = float(close_s.loc[day]) if day in close_s.index and not np.isnan(close_s.loc[day]) else None
-            r_vals.append(round(r, 2) if r is not None else None)
-            m_vals.append(round(m, 2) if m is not None else None)
-            c_vals.append(round(c, 3))
-            ret_vals.append(round(ret, 4) if ret is not None else None)
-            ma50_vals.append(round(ma50d, 4) if ma50d is not None else None)
-            close_vals.append(round(p, 2) if p is not None else None)
-            if r is not None and m is not None:
-                raw_phases.append(classify_phase(r, m))
-            elif raw_phases:
-                raw_phases.append(raw_phases[-1])  # carry forward
-            else:
-                raw_phases.append("lagging")
+        r_vals = _rounded_on(rr, trading_days, 2)
+        m_vals = _rounded_on(rm, trading_days, 2)
+        c_vals = [0.0 if x is None else x for x in _rounded(cmf_s.reindex(trading_days).to_numpy(), 3)]
+        ret_vals = _rounded_on(ret_s, trading_days, 4)
+        ma50_vals = _rounded_on(ma50_s, trading_days, 4)
+        close_vals = _rounded_on(close[t], trading_days, 2)
 
         # Smooth phases with confirmation, but use full history for warmup
         # Get raw phases for the full RS series (not just last N days)
-        full_raw = []
-        for day in rr.dropna().index:
-            if day in rm.index and not np.isnan(rm.loc[day]):
-                full_raw.append(classify_phase(float(rr.loc[day]), float(rm.loc[day])))
-        full_smoothed = smooth_phase_series(full_raw)
+        ok = ok_panel[:, i]
+        full_smoothed = smooth_phase_series(codes_panel[ok, i])
         # Extract the last `days` smoothed values (aligned with trading_days)
-        p_vals = full_smoothed[-len(trading_days):] if len(full_smoothed) >= len(trading_days) else raw_phases
+        if len(full_smoothed) >= len(trading_days):
+            p_codes = full_smoothed[-len(trading_days):]
+        else:
+            # Short history: raw phase per day, carried forward over missing days
+            # (LAGGING before the first one)
+            day_ok = ok[day_rows]
+            raw = np.where(day_ok, codes_panel[day_rows, i], LAGGING)
+            last_ok = np.maximum.accumulate(np.where(day_ok, np.arange(len(raw)), -1))
+            p_codes = np.where(last_ok >= 0, raw[np.maximum(last_ok, 0)], LAGGING).tolist()
+        p_vals = [PHASE_NAMES[c] for c in p_codes]
 
         sectors[t] = {
             "r": r_vals, "m": m_vals, "p": p_vals, "c": c_vals, "ret": ret_vals,
@@ -724,60 +1118,79 @@ def generate_stock_history(data_all, days=252, sector_holdings=None):
     low_all = data_all["Low"]
     volume_all = data_all["Volume"]
 
+    has_hlv = set(high_all.columns) & set(low_all.columns) & set(volume_all.columns)
+    day_rows = close_all.index.get_indexer(trading_days)  # trading days are benchmark rows
+
     results = {}
     for etf, holdings in sector_holdings.items():
-        available = [h for h in holdings if h in close_all.columns and close_all[h].dropna().shape[0] > 80]
+        available = list(dict.fromkeys(
+            h for h in holdings if h in close_all.columns and close_all[h].count() > 80))
         if not available:
             continue
 
-        stocks = {}
-        for ticker in available:
-            c = close_all[ticker].dropna()
-            if len(c) < 80:
-                continue
+        # MA50 distance and RSI for the whole sector in one pass each. RSI runs
+        # on each stock's own closes; rolling the MA50 over a gap-free column
+        # equals rolling over its compacted closes, and stocks with gaps are
+        # recomputed compacted below.
+        c_all = close_all[available]
+        c_arr = c_all.to_numpy(dtype=np.float64)
+        own_ok = ~np.isnan(c_arr)
+        block = _is_contiguous(own_ok)
+        ma50_all = (c_all / c_all.rolling(50).mean()) - 1
+        rsi_td = compute_rsi_batch(c_arr)[day_rows]
+
+        # CMF runs on the full date index either way, so it is frame-wide for all
+        cmf_cols = [t for t in available if t in has_hlv]
+        h, l, v = high_all[cmf_cols], low_all[cmf_cols], volume_all[cmf_cols]
+        hl_range = h - l
+        mfv = ((c_all[cmf_cols] - l) - (h - c_all[cmf_cols])) / hl_range.where(hl_range != 0) * v
+        cmf_all = mfv.rolling(21).sum() / v.rolling(21).sum()
+
+        # Frame-wide values on the trading days, gathered once per sector
+        close_td = c_arr[day_rows]
+        ma50_td = ma50_all.to_numpy()[day_rows]
+        cmf_td = cmf_all.to_numpy()[day_rows]
+        cmf_idx = {t: j for j, t in enumerate(cmf_cols)}
+
+        # Weight: dollar volume based (stable proxy for importance) — mean of
+        # each stock's last 20 own closes times its last-20-day mean volume
+        # (NaN days skipped). Both are (stocks, 20) blocks with one row per
+        # stock, so each row sums like the Series.mean() it replaces.
+        seen = np.cumsum(own_ok, axis=0)
+        col_20, row_20 = np.nonzero((own_ok & (seen > seen[-1] - 20)).T)
+        recent_close = c_arr[row_20, col_20].reshape(len(available), 20).sum(axis=1) / 20
+        v_20 = np.ascontiguousarray(
+            volume_all.reindex(columns=available).to_numpy(dtype=np.float64)[-20:].T)
+        v_ok = ~np.isnan(v_20)
+        with np.errstate(invalid="ignore"):
+            recent_vol = np.where(v_ok, v_20, 0.0).sum(axis=1) / v_ok.sum(axis=1)
+        dollar_vols = (recent_close * recent_vol).tolist()
 
+        stocks = {}
+        for i, ticker in enumerate(available):
             # MA50 distance
-            ma50 = c.rolling(50).mean()
-            ma50_dist = (c / ma50) - 1
+            if block[i]:
+                ma50_vals = _rounded(ma50_td[:, i], 4)
+            else:
+                c = close_all[ticker].dropna()
+                ma50 = c.rolling(50).mean()
+                ma50_vals = _rounded_on((c / ma50) - 1, trading_days, 4)
 
             # RSI
-            rsi_s = compute_rsi_series(c)
+            rsi_vals = _rounded(rsi_td[:, i], 1)
 
-            # CMF
-            if ticker in high_all.columns and ticker in low_all.columns and ticker in volume_all.columns:
-                h = high_all[ticker]
-                l = low_all[ticker]
-                v = volume_all[ticker]
-                hl_range = h - l
-                hl_range = hl_range.replace(0, np.nan)
-                mfm = ((c - l) - (h - c)) / hl_range
-                mfv = mfm * v
-                cmf_s = mfv.rolling(21).sum() / v.rolling(21).sum()
+            # CMF (0 on the stock's own days when high/low/volume are missing)
+            if ticker in has_hlv:
+                cmf_vals = _rounded(cmf_td[:, cmf_idx[ticker]], 3)
             else:
-                cmf_s = pd.Series(0.0, index=c.index)
-
-            # Weight: dollar volume based (stable proxy for importance)
-            recent_close = c.iloc[-20:].mean() if len(c) >= 20 else c.iloc[-1]
-            recent_vol = volume_all[ticker].iloc[-20:].mean() if ticker in volume_all.columns else 0
-            dollar_vol = float(recent_close * recent_vol) if not np.isnan(recent_close * recent_vol) else 0
-
-            ma50_vals = []
-            rsi_vals = []
-            cmf_vals = []
-            close_vals = []
-            for day in trading_days:
-                m = float(ma50_dist.loc[day]) if day in ma50_dist.index and not np.isnan(ma50_dist.loc[day]) else None
-                r = float(rsi_s.loc[day]) if day in rsi_s.index and not np.isnan(rsi_s.loc[day]) else None
-                cf = float(cmf_s.loc[day]) if day in cmf_s.index and not np.isnan(cmf_s.loc[day]) else None
-                p = float(c.loc[day]) if day in c.index and not np.isnan(c.loc[day]) else None
-                ma50_vals.append(round(m, 4) if m is not None else None)
-                rsi_vals.append(round(r, 1) if r is not None else None)
-                cmf_vals.append(round(cf, 3) if cf is not None else None)
-                close_vals.append(round(p, 2) if p is not None else None)
+                cmf_vals = _rounded(np.where(np.isnan(close_td[:, i]), np.nan, 0.0), 3)
+
+            dollar_vol = dollar_vols[i] if dollar_vols[i] == dollar_vols[i] else 0
 
             stocks[ticker] = {
                 "ma50": ma50_vals, "rsi": rsi_vals, "cmf": cmf_vals,
-                "close": close_vals, "dollar_vol": dollar_vol,
+                "close": _rounded(close_td[:, i], 2),
+                "dollar_vol": dollar_vol,
             }
 
         # Normalize weights (0-100 scale per sector)
@@ -816,8 +1229,7 @@ def _generate_sample_history(days=90):
             m_base += drift_m + rng.normal(0, 0.2)
             r_vals.append(round(float(np.clip(r_base, 94, 106)), 2))
             m_vals.append(round(float(np.clip(m_base, 94, 106)), 2))
-        raw_phases = [classify_phase(r, m) for r, m in zip(r_vals, m_vals)]
-        p_vals = smooth_phase_series(raw_phases)
+        p_vals = [PHASE_NAMES[c] for c in smooth_phase_series(phase_codes(r_vals, m_vals))]
         sectors[etf] = {
             "r": r_vals, "m": m_vals, "p": p_vals,
             "name": meta["name"], "color": meta["color"],
@@ -853,14 +1265,7 @@ def generate_sample_data():
         ret_5d = bias * 3 + rng.normal(0, 0.008)
         ret_20d = bias * 10 + rng.normal(0, 0.015)
 
-        if rs_ratio >= 100 and rs_mom >= 100:
-            phase = "leading"
-        elif rs_ratio < 100 and rs_mom >= 100:
-            phase = "improving"
-        elif rs_ratio >= 100 and rs_mom < 100:
-            phase = "weakening"
-        else:
-            phase = "lagging"
+        phase = classify_phase(rs_ratio, rs_mom)
         phase_value = float(np.clip(((rs_ratio - 95) + (rs_mom - 95)) / 20 * 100, 0, 100))
 
         nodes.append({
@@ -904,8 +1309,11 @@ def generate_sample_data():
 # ---------------------------------------------------------------------------
 # Sector detail — individual stock phases
 # ---------------------------------------------------------------------------
-def compute_sector_detail(etf, data_all, sector_holdings=None):
-    """Compute phases for individual stocks vs their sector ETF."""
+def compute_sector_detail(etf, data_all, sector_holdings=None, holdings_rs=None):
+    """Compute phases for individual stocks vs their sector ETF.
+
+    `holdings_rs` is an optional compute_holdings_rs(...)[etf] result to reuse.
+    """
     if sector_holdings is None:
         sector_holdings = SECTOR_HOLDINGS_FALLBACK
     holdings = sector_holdings.get(etf, [])
@@ -919,95 +1327,124 @@ def compute_sector_detail(etf, data_all, sector_holdings=None):
     close = data_all["Close"]
     volume = data_all["Volume"]
 
-    available = [h for h in holdings if h in close.columns and close[h].dropna().shape[0] > 30]
+    # Closes per listed holding, counted in one pass over the frame
+    listed = [h for h in holdings if h in close.columns]
+    n_closes = close[list(dict.fromkeys(listed))].count().to_dict()
+    available = [h for h in listed if n_closes[h] > 30]
     if not available:
         return None
 
-    spy_returns = spy.pct_change().dropna()
+    # Days with a valid SPY return, as a mask over the shared date index
+    spy_ret_ok = spy.pct_change().notna().to_numpy()
 
     # Sector 5d return for leader/laggard comparison
-    sector_r5 = float(sector_close.iloc[-1] / sector_close.iloc[-5] - 1) if len(sector_close) >= 5 else 0.0
-
-    stocks = []
-    for ticker in available:
-        c = close[ticker].dropna()
-        if len(c) < 30:
-            continue
-
-        returns = c.pct_change().dropna()
-        common_idx = returns.index.intersection(spy_returns.index)
-        if len(common_idx) < 20:
-            continue
-
-        # 5d and 20d returns
-        r5 = float(c.iloc[-1] / c.iloc[-5] - 1) if len(c) >= 5 else 0.0
-        r20 = float(c.iloc[-1] / c.iloc[-20] - 1) if len(c) >= 20 else 0.0
-        if np.isnan(r5): r5 = 0.0
-        if np.isnan(r20): r20 = 0.0
+    sector_arr = sector_close.to_numpy(dtype=np.float64)
+    sector_r5 = float(sector_arr[-1] / sector_arr[-5] - 1) if len(sector_arr) >= 5 else 0.0
+
+    # 20-day average / last volume for every holding (missing column -> NaN)
+    vol_hold = volume.reindex(columns=available).to_numpy(dtype=np.float64)
+    v_avg_all = vol_hold[-20:].mean(axis=0) if len(vol_hold) >= 20 else np.full(len(available), np.nan)
+    v_now_all = vol_hold[-1]
+
+    # RS-Ratio/Momentum series vs sector ETF for every holding in one batch
+    close_hold = close[available].to_numpy(dtype=np.float64)
+    if holdings_rs is None:
+        rr_full, rm_full = compute_rs_series_batch(close_hold, sector_arr)
+    else:
+        rr_full, rm_full = (f[available].to_numpy() for f in holdings_rs)
+    rr_now, rm_now, rr_prev, rm_prev = _rs_latest(rr_full, rm_full)
+    raw_now = phase_codes(rr_now, rm_now)
+    phase_value_now = _phase_value(rr_now, rm_now)
+    phase_delta_all = phase_value_now - _phase_value(rr_prev, rm_prev)
+
+    # Holdings with enough history: 30+ closes, 20+ of them after the first
+    # on days with a valid SPY return
+    own_ok = ~np.isnan(close_hold)
+    n_own = own_ok.sum(axis=0)
+    first = own_ok.argmax(axis=0)
+    last = len(own_ok) - 1 - own_ok[::-1].argmax(axis=0)
+    cols = np.arange(len(available))
+    n_spy = (own_ok & spy_ret_ok[:, None]).sum(axis=0) - spy_ret_ok[first]
+    eligible = (n_own >= 30) & (n_spy >= 20)
+
+    # 5d / 20d returns over each holding's own closes: the k-th last close is
+    # the row where the running count of closes reaches n_own - k + 1
+    seen = np.cumsum(own_ok, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c_now = close_hold[last, cols]
+        r5_all, r20_all = (
+            c_now / close_hold[((seen == n_own - k + 1) & own_ok).argmax(axis=0), cols] - 1
+            for k in (5, 20))
+    r5_all = np.where((n_own >= 5) & ~np.isnan(r5_all), r5_all, 0.0)
+    r20_all = np.where((n_own >= 20) & ~np.isnan(r20_all), r20_all, 0.0)
+
+    # Raw phase codes for every holding in one op: over a gap-free column they
+    # equal those of the compacted closes, holdings with gaps are recomputed
+    # compacted in the loop below. RSI runs on each holding's own closes.
+    block = _is_contiguous(own_ok)
+    rs_ok = ~np.isnan(rm_full)
+    rs_codes = phase_codes(rr_full, rm_full)
+    rsi_last = compute_rsi_batch(close_hold)[last, cols]
+
+    # Volume ratio and market weight proxy: price * avg daily volume (dollar volume)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vol_ratio_all = np.where(v_avg_all > 0, v_now_all / v_avg_all, 1.0)
+    dollar_vol_all = c_now * v_avg_all
+    dollar_vol_all[np.isnan(dollar_vol_all)] = 0.0
+
+    # Per-holding scalars as Python floats, converted once for all holdings
+    rr_list, rm_list = rr_now.tolist(), rm_now.tolist()
+    pv_list, pd_list = phase_value_now.tolist(), phase_delta_all.tolist()
+    r5_list, r20_list = r5_all.tolist(), r20_all.tolist()
+    vol_ratio_list = vol_ratio_all.tolist()
+    rsi_list = rsi_last.tolist()
+
+    # Per-stock dicts for the JSON, plus parallel columns for weight and ordering
+    stocks, sort_rank, sort_value = [], [], []
+    phase_rank = (3, 1, 2, 0)  # by phase code: leading, improving, weakening, lagging
+    stock_cols = np.flatnonzero(eligible)  # close_hold column of each stock
+    for i in stock_cols.tolist():
+        ticker = available[i]
+        r5, r20 = r5_list[i], r20_list[i]
 
         # RS-Ratio/Momentum vs sector ETF
-        rs_ratio, rs_mom, rs_ratio_prev, rs_mom_prev = compute_rs(c, sector_close)
-
-        phase_value = float(np.clip(((rs_ratio - 95) + (rs_mom - 95)) / 20 * 100, 0, 100))
+        rs_ratio, rs_mom = rr_list[i], rm_list[i]
+        phase_value = pv_list[i]
+        phase_delta = round(pd_list[i], 1)
 
-        phase_value_prev = float(np.clip(((rs_ratio_prev - 95) + (rs_mom_prev - 95)) / 20 * 100, 0, 100))
-        phase_delta = round(phase_value - phase_value_prev, 1)
-
-        # Smoothed phase: compute raw series then apply confirmation filter
+        # Smoothed phase: raw series (compacted closes when the holding has
+        # gaps) then confirmation filter
         days_in_phase = 0
         previous_phase = None
-        phase = classify_phase(rs_ratio, rs_mom)  # fallback
-        if len(c) >= 60:
-            _rs = c / sector_close.reindex(c.index)
-            _rs_sma = _rs.rolling(20).mean()
-            _rr = (_rs / _rs_sma) * 100
-            _rm = (_rr / _rr.shift(20)) * 100
-            _raw_phases = []
-            for _day in _rm.dropna().index:
-                _raw_phases.append(classify_phase(float(_rr.loc[_day]), float(_rm.loc[_day])))
-            _smoothed = smooth_phase_series(_raw_phases[-60:])
-            if _smoothed:
-                phase = _smoothed[-1]
-                current = _smoothed[-1]
-                count = 0
-                for k in range(len(_smoothed) - 1, -1, -1):
-                    if _smoothed[k] == current:
-                        count += 1
-                    else:
-                        break
-                days_in_phase = count
-                for k in range(len(_smoothed) - days_in_phase - 1, -1, -1):
-                    if _smoothed[k] != current:
-                        previous_phase = _smoothed[k]
-                        break
+        code = raw_now[i]  # fallback
+        if n_own[i] >= 60:
+            if block[i]:
+                raw_codes = rs_codes[rs_ok[:, i], i]
+            else:
+                pos = np.flatnonzero(own_ok[:, i])
+                _rr, _rm = compute_rs_series_batch(close_hold[pos, i][:, None], sector_arr[pos])
+                _ok = ~np.isnan(_rm[:, 0])
+                raw_codes = phase_codes(_rr[_ok, 0], _rm[_ok, 0])
+            _smoothed = _smooth_code_array(raw_codes[-60:])
+            if len(_smoothed):
+                code = _smoothed[-1]
+                days_in_phase, previous_code = _phase_streak(_smoothed)
+                previous_phase = PHASE_NAMES[previous_code] if previous_code is not None else None
+        phase = PHASE_NAMES[code]
 
         # Leader/laggard vs sector ETF
         sector_relative = "leader" if r5 > sector_r5 else "laggard"
 
-        # Volume ratio
-        v_avg = volume[ticker].rolling(20).mean().iloc[-1] if ticker in volume.columns else 1
-        v_now = volume[ticker].iloc[-1] if ticker in volume.columns else 1
-        vol_ratio = float(v_now / v_avg) if v_avg > 0 and not np.isnan(v_avg) else 1.0
-
         # RSI
-        rsi_val = 50.0
-        if len(c) >= 14:
-            rsi_s = compute_rsi_series(c)
-            rv = rsi_s.iloc[-1]
-            if not np.isnan(rv):
-                rsi_val = round(float(rv), 1)
-
-        # Market weight proxy: price * avg daily volume (dollar volume)
-        price = float(c.iloc[-1]) if len(c) > 0 else 0
-        avg_vol = float(volume[ticker].rolling(20).mean().iloc[-1]) if ticker in volume.columns else 0
-        dollar_vol = price * avg_vol if not np.isnan(price * avg_vol) else 0
+        rv = rsi_list[i]
+        rsi_val = round(rv, 1) if rv == rv else 50.0
 
         stocks.append({
             "id": ticker,
             "name": ticker,
             "return_5d": round(r5, 5),
             "return_20d": round(r20, 5),
-            "volume_ratio": round(vol_ratio, 2),
+            "volume_ratio": round(vol_ratio_list[i], 2),
             "momentum_phase": phase,
             "phase_value": round(phase_value, 1),
             "phase_delta": phase_delta,
@@ -1017,39 +1454,41 @@ def compute_sector_detail(etf, data_all, sector_holdings=None):
             "sector_relative": sector_relative,
             "days_in_phase": days_in_phase,
             "previous_phase": previous_phase,
-            "_dollar_vol": dollar_vol,
         })
+        sort_rank.append(phase_rank[code])
+        sort_value.append(round(phase_value, 1))
 
-    # Compute relative weight (normalize to 0-100)
+    # Relative weight (normalized to 0-100), then sort by phase then phase_value
     if stocks:
-        max_dv = max(s["_dollar_vol"] for s in stocks) or 1
-        for s in stocks:
-            s["weight"] = round(s["_dollar_vol"] / max_dv * 100, 1)
-            del s["_dollar_vol"]
-
-    # Sort by phase then phase_value
-    phase_order = {"leading": 0, "improving": 1, "weakening": 2, "lagging": 3}
-    stocks.sort(key=lambda s: (phase_order.get(s["momentum_phase"], 2), -s["phase_value"]))
+        dv = dollar_vol_all[stock_cols]
+        weights = dv / (dv.max() or 1) * 100
+        for s, w in zip(stocks, weights.tolist()):
+            s["weight"] = round(w, 1)
+        order = np.lexsort((-np.array(sort_value), np.array(sort_rank)))
+        stocks = [stocks[k] for k in order]
+        stock_cols = stock_cols[order]
 
     # Pairwise return correlations between stocks (20-day)
     correlations = []
     stock_tickers = [s["id"] for s in stocks]
     if len(stock_tickers) >= 2:
-        returns_df = close[stock_tickers].pct_change().tail(20).dropna()
-        if len(returns_df) >= 10:
-            corr_matrix = returns_df.corr()
-            for i, t1 in enumerate(stock_tickers):
-                for t2 in stock_tickers[i + 1:]:
-                    if t1 in corr_matrix.columns and t2 in corr_matrix.columns:
-                        c = float(corr_matrix.loc[t1, t2])
-                        if not np.isnan(c) and abs(c) > 0.4:
-                            correlations.append({
-                                "source": t1,
-                                "target": t2,
-                                "correlation": round(c, 3),
-                            })
-        correlations.sort(key=lambda x: abs(x["correlation"]), reverse=True)
-        correlations = correlations[:20]
+        # Last 20 daily returns, dropping days where any stock has no return
+        recent = close_hold[-21:, stock_cols]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = recent[1:] / recent[:-1] - 1
+        returns = returns[~np.isnan(returns).any(axis=1)]
+        if len(returns) >= 10:
+            # Upper triangle, |corr| > 0.4, top 20 by rounded |corr| (stable on ties)
+            iu, ju = np.triu_indices(len(stock_tickers), k=1)
+            vals = _corr_matrix(returns)[iu, ju]
+            keep = np.flatnonzero(np.abs(vals) > 0.4)
+            rounded = np.array(_rounded(vals[keep], 3), dtype=np.float64)
+            for k in _top_k(np.abs(rounded), 20):
+                correlations.append({
+                    "source": stock_tickers[iu[keep[k]]],
+                    "target": stock_tickers[ju[keep[k]]],
+                    "correlation": float(rounded[k]),
+                })
 
     return {
         "etf": etf,
@@ -1064,8 +1503,94 @@ def compute_sector_detail(etf, data_all, sector_holdings=None):
 # ---------------------------------------------------------------------------
 # Signal history — backfill + daily tracking
 # ---------------------------------------------------------------------------
-def backfill_signal_history(data_all, sector_holdings=None):
-    """Replay 90 days of price data to build full signal history."""
+@njit(parallel=True, cache=True, nogil=True)
+def _replay_signals(today, prev, rm, price_ok, day_ord, max_days, first):
+    """Signal state machine over (tickers, days) phase-code arrays.
+
+    Opens on entry into IMPROVING with RS-Momentum >= 103 and a valid price;
+    closes on LEADING (confirmed), WEAKENING/LAGGING (reversed) or after
+    `max_days` calendar days (expired). Days without a phase are skipped, and
+    ticker k is walked from its first opening day first[k].
+    Per signal n of ticker k: open row, last update row, last row with a
+    price, outcome code, last phase code; count[k] signals were written.
+    """
+    n_tickers, n_days = today.shape
+    cap = n_days // 2 + 1
+    open_t = np.zeros((n_tickers, cap), dtype=np.int64)
+    last_t = np.zeros((n_tickers, cap), dtype=np.int64)
+    price_t = np.zeros((n_tickers, cap), dtype=np.int64)
+    reason = np.zeros((n_tickers, cap), dtype=np.int8)
+    last_code = np.zeros((n_tickers, cap), dtype=np.int8)
+    count = np.zeros(n_tickers, dtype=np.int64)
+    for k in prange(n_tickers):
+        n = 0
+        active = False
+        for i in range(first[k], n_days):
+            p = today[k, i]
+            if p < 0 or prev[k, i] < 0:
+                continue
+            if p == IMPROVING and prev[k, i] != IMPROVING:
+                if rm[k, i] < 103:
+                    continue
+                if not active and price_ok[k, i]:
+                    active = True
+                    open_t[k, n] = i
+                    price_t[k, n] = i
+            if active:
+                last_t[k, n] = i
+                last_code[k, n] = p
+                if price_ok[k, i]:
+                    price_t[k, n] = i
+                closed = True
+                if p == LEADING:
+                    reason[k, n] = CONFIRMED
+                elif p == WEAKENING or p == LAGGING:
+                    reason[k, n] = REVERSED
+                elif day_ord[i] - day_ord[open_t[k, n]] > max_days:
+                    reason[k, n] = EXPIRED
+                else:
+                    closed = False
+                if closed:
+                    active = False
+                    n += 1
+        if active:
+            reason[k, n] = ACTIVE
+            n += 1
+        count[k] = n
+    return open_t, last_t, price_t, reason, last_code, count
+
+
+def _order_history(history):
+    """Active signals first (newest open first), then closed (newest close first).
+
+    The (is_active, date) key is built once per signal and the list is sorted
+    a single time on it; signals on the same date keep their order.
+    """
+    keyed = [((True, s.get("open_date", "")) if s["status"] == "active"
+              else (False, s.get("close_date", "")), s)
+             for s in history if s["status"] in ("active", "closed")]
+    keyed.sort(key=itemgetter(0), reverse=True)
+    return [s for _, s in keyed]
+
+
+def _split_status(history):
+    """Split signals into (active, closed) lists in a single pass."""
+    active, closed = [], []
+    for s in history:
+        status = s["status"]
+        if status == "active":
+            active.append(s)
+        elif status == "closed":
+            closed.append(s)
+    return active, closed
+
+
+def backfill_signal_history(data_all, sector_holdings=None, holdings_rs=None):
+    """Replay 90 days of price data to build full signal history.
+
+    `holdings_rs` is an optional compute_holdings_rs(data_all, sector_holdings)
+    result to reuse.
+    """
     if sector_holdings is None:
         sector_holdings = SECTOR_HOLDINGS_FALLBACK
     close = data_all["Close"]
@@ -1080,174 +1605,159 @@ def backfill_signal_history(data_all, sector_holdings=None):
 
     all_tickers = list(ticker_sector.keys())
 
-    # Compute full phase series + RS-Momentum + RSI for each stock vs sector ETF
-    phase_series = {}
-    rm_series = {}
-    rsi_series = {}
-    for ticker in all_tickers:
-        c = close[ticker].dropna()
-        if len(c) < 40:
-            continue
-        etf = ticker_sector[ticker]
-        sector_close = close[etf].dropna()
-        common = c.index.intersection(sector_close.index)
-        c = c.loc[common]
-        s = sector_close.loc[common]
-        if len(c) < 40:
-            continue
-
-        rs = c / s
-        rs_sma = rs.rolling(20).mean()
-        rr = (rs / rs_sma) * 100
-        rm = (rr / rr.shift(20)) * 100
-
-        phases = pd.Series(np.nan, index=rr.index)
-        valid = rm.dropna().index
-        phases.loc[valid] = "lagging"
-        mask_rr = rr.loc[valid]
-        mask_rm = rm.loc[valid]
-        phases.loc[valid[(mask_rr >= 100) & (mask_rm >= 100)]] = "leading"
-        phases.loc[valid[(mask_rr >= 100) & (mask_rm < 100)]] = "weakening"
-        phases.loc[valid[(mask_rr < 100) & (mask_rm >= 100)]] = "improving"
-        phase_series[ticker] = phases.dropna()
-        rm_series[ticker] = rm
-        rsi_series[ticker] = compute_rsi_series(close[ticker].dropna())
-
     # Get trading days — use all available after RS warmup (~40 days)
     trading_days = spy.dropna().index
     # RS needs 20d SMA + 20d shift = 40 days warmup, leave 50 for safety
     start_idx = max(0, 50)
     replay_days = trading_days[start_idx:]
+    n_days = len(replay_days)
+
+    # Stocks with enough history, alone and on days their sector ETF also traded
+    C = close[all_tickers].to_numpy(dtype=np.float64)
+    S = close[[ticker_sector[t] for t in all_tickers]].to_numpy(dtype=np.float64)
+    own_ok = ~np.isnan(C)
+    ok = own_ok & ~np.isnan(S)
+    keep = (own_ok.sum(axis=0) >= 40) & (ok.sum(axis=0) >= 40)
+    tickers = [t for t, k in zip(all_tickers, keep) if k]
+    C, S, own_ok, ok = C[:, keep], S[:, keep], own_ok[:, keep], ok[:, keep]
+    n_rows = len(C)
+
+    # RS series vs sector ETF on the (T, tickers) grid. The rolling windows run
+    # over each stock's gap-free rows, so one batch covers every column whose
+    # common rows are a single block; gappy columns are computed compacted.
+    if holdings_rs is None:
+        rr, rm = compute_rs_series_batch(C, S)
+    else:
+        rr, rm = np.empty_like(C), np.empty_like(C)
+        for etf, (rr_e, rm_e) in holdings_rs.items():
+            k = [j for j, t in enumerate(tickers) if ticker_sector[t] == etf]
+            if k:
+                cols = [tickers[j] for j in k]
+                rr[:, k], rm[:, k] = rr_e[cols].to_numpy(), rm_e[cols].to_numpy()
+    for k in np.flatnonzero(~_is_contiguous(ok)):
+        rows = np.flatnonzero(ok[:, k])
+        rr_k, rm_k = compute_rs_series_batch(C[rows, k][:, None], S[rows, k])
+        rr[:, k] = rm[:, k] = np.nan
+        rr[rows, k], rm[rows, k] = rr_k[:, 0], rm_k[:, 0]
+
+    # Per stock and day (-1 / NaN where there is no phase): today's phase code,
+    # the code of the previous phase day, RS-Momentum
+    has_phase = ~np.isnan(rm)
+    codes = np.where(has_phase, phase_codes(rr, rm), -1).astype(np.int8)
+    row_no = np.arange(n_rows)[:, None]
+    last_row = np.maximum.accumulate(np.where(has_phase, row_no, -1), axis=0)
+    prev_row = np.vstack([np.full((1, len(tickers)), -1), last_row[:-1]])
+    prev_codes = np.take_along_axis(codes, np.maximum(prev_row, 0), axis=0)
+    prev_codes = np.where(has_phase & (prev_row >= 0), prev_codes, -1).astype(np.int8)
 
     history = []
-    active_signals = {}  # ticker → signal dict
+    if tickers and n_days:
+        day_rows = close.index.get_indexer(replay_days)
+        today_m = codes[day_rows].T.copy()
+        prev_m = prev_codes[day_rows].T.copy()
+        rm_m = rm[day_rows].T.copy()
+        close_m = C[day_rows].T.copy()
+        spy_arr = spy.to_numpy(dtype=np.float64)[day_rows]
+        # Day numbers straight from the datetime64 values (wall-clock dates if tz-aware)
+        wall_days = replay_days if replay_days.tz is None else replay_days.tz_localize(None)
+        day_ord = wall_days.values.astype("datetime64[D]").astype(np.int64)
+        date_strs = replay_days.strftime("%Y-%m-%d")
+
+        # Days a signal can open on (phase days are the only ones with RS-Momentum):
+        # the state machine only runs for tickers with one, from the first of them
+        price_ok = ~np.isnan(close_m)
+        opens = ((today_m == IMPROVING) & (prev_m >= 0) & (prev_m != IMPROVING)
+                 & (rm_m >= 103) & price_ok)
+        live = np.flatnonzero(opens.any(axis=1))
+        # RSI (on each stock's own gap-free closes) is only read at signal opens
+        rsi_m = compute_rsi_batch(C[:, live])[day_rows].T
+        open_t, last_t, price_t, reason, last_code, count = _replay_signals(
+            today_m[live], prev_m[live], rm_m[live], price_ok[live], day_ord, 30,
+            opens[live].argmax(axis=1))
+
+        # Flatten to one row per signal, in the order signals were opened (day, then
+        # ticker), and gather prices/returns for all of them at once
+        sig_k, sig_n = np.nonzero(np.arange(open_t.shape[1]) < count[:, None])
+        order = np.lexsort((sig_k, open_t[sig_k, sig_n]))
+        sig_k, sig_n = sig_k[order], sig_n[order]
+        t0, t1, tp = (a[sig_k, sig_n] for a in (open_t, last_t, price_t))
+        reason, last_code = reason[sig_k, sig_n], last_code[sig_k, sig_n]
+        rsi_open = rsi_m[sig_k, t0]
+        sig_k = live[sig_k]
+        open_price = close_m[sig_k, t0]
+        spy_open = spy_arr[t0]
+        stock_ret = close_m[sig_k, tp] / open_price - 1
+        spy_ret = spy_arr[tp] / spy_open - 1
+        columns = zip(sig_k.tolist(), t0.tolist(), t1.tolist(), open_price.tolist(),
+                      spy_open.tolist(), stock_ret.tolist(), (stock_ret - spy_ret).tolist(),
+                      rsi_open.tolist(), (day_ord[t1] - day_ord[t0]).tolist(),
+                      reason.tolist(), last_code.tolist())
+        for k, i0, i1, o_px, s_px, ret, ret_vs, rv, days, why, code in columns:
+            ticker = tickers[k]
+            etf = ticker_sector[ticker]
+            history.append({
+                "ticker": ticker,
+                "sector": etf,
+                "sector_name": SECTOR_NAMES[etf],
+                "open_date": date_strs[i0],
+                "open_price": o_px,
+                "spy_open_price": s_px,
+                "current_phase": PHASE_NAMES[code],
+                "days_active": days,
+                "return_vs_spy": round(ret_vs, 5),
+                "return_abs": round(ret, 5),
+                "rsi": round(rv, 0) if not np.isnan(rv) else 50.0,
+                "status": "active" if why == ACTIVE else "closed",
+                "close_date": date_strs[i1] if why != ACTIVE else None,
+                "close_reason": CLOSE_REASONS[why],
+            })
+
+    history = _order_history(history)
+
+    active, closed = _split_status(history)
+    n_wins = sum(s.get("return_vs_spy", 0) > 0 for s in closed)
+    print(f"  Backfill: {len(history)} signals ({len(active)} active, "
+          f"{len(closed)} closed, {n_wins}/{len(closed)} wins)")
 
-    for i, day in enumerate(replay_days):
-        date_str = day.strftime("%Y-%m-%d")
-        spy_price = float(spy.loc[day])
+    return history
 
-        for ticker in phase_series:
-            ps = phase_series[ticker]
-            if day not in ps.index:
-                continue
 
-            phase_today = ps.loc[day]
+def _sector_detail_inputs(etf, data_all, sector_holdings, holdings_rs):
+    """compute_sector_detail arguments cut down to the ETF, SPY and its holdings."""
+    holdings = sector_holdings.get(etf, [])
+    close = data_all["Close"]
+    cols = [c for c in dict.fromkeys([etf, BENCHMARK, *holdings]) if c in close.columns]
+    sliced = {"Close": close[cols], "Volume": data_all["Volume"].reindex(columns=cols)}
+    return etf, sliced, {etf: holdings}, holdings_rs.get(etf)
 
-            # Find yesterday's phase
-            day_pos = ps.index.get_loc(day)
-            if day_pos == 0:
-                continue
-            phase_yesterday = ps.iloc[day_pos - 1]
 
-            # Check for new signal: entering improving with strong momentum
-            if phase_today == "improving" and phase_yesterday != "improving":
-                # Filter: RS-Momentum must be >= 101 (not just barely crossing 100)
-                rm_val = rm_series[ticker].loc[day] if day in rm_series[ticker].index else 100
-                if rm_val < 103:
-                    continue
-                if ticker not in active_signals and ticker in close.columns:
-                    stock_price = float(close[ticker].loc[day])
-                    if not np.isnan(stock_price):
-                        etf = ticker_sector[ticker]
-                        rsi_val = 50.0
-                        if ticker in rsi_series and day in rsi_series[ticker].index:
-                            rv = rsi_series[ticker].loc[day]
-                            if not np.isnan(rv):
-                                rsi_val = round(float(rv), 0)
-                        sig = {
-                            "ticker": ticker,
-                            "sector": etf,
-                            "sector_name": SECTOR_ETFS[etf]["name"],
-                            "open_date": date_str,
-                            "open_price": stock_price,
-                            "spy_open_price": spy_price,
-                            "current_phase": "improving",
-                            "days_active": 0,
-                            "return_vs_spy": 0.0,
-                            "return_abs": 0.0,
-                            "rsi": rsi_val,
-                            "status": "active",
-                            "close_date": None,
-                            "close_reason": None,
-                        }
-                        active_signals[ticker] = sig
-                        history.append(sig)
-
-            # Update active signals
-            if ticker in active_signals:
-                sig = active_signals[ticker]
-                stock_price = float(close[ticker].loc[day]) if ticker in close.columns else np.nan
-                if not np.isnan(stock_price):
-                    stock_ret = stock_price / sig["open_price"] - 1
-                    spy_ret = spy_price / sig["spy_open_price"] - 1
-                    sig["return_vs_spy"] = round(stock_ret - spy_ret, 5)
-                    sig["return_abs"] = round(stock_ret, 5)
-                sig["current_phase"] = phase_today
-                open_date = datetime.strptime(sig["open_date"], "%Y-%m-%d")
-                sig["days_active"] = (day.to_pydatetime().replace(tzinfo=None) - open_date).days
-
-                # Close conditions
-                if phase_today == "leading":
-                    sig["status"] = "closed"
-                    sig["close_date"] = date_str
-                    sig["close_reason"] = "confirmed"
-                    del active_signals[ticker]
-                elif phase_today in ("weakening", "lagging"):
-                    sig["status"] = "closed"
-                    sig["close_date"] = date_str
-                    sig["close_reason"] = "reversed"
-                    del active_signals[ticker]
-                elif sig["days_active"] > 30:
-                    sig["status"] = "closed"
-                    sig["close_date"] = date_str
-                    sig["close_reason"] = "expired"
-                    del active_signals[ticker]
-
-    # Sort: active first (newest first), then closed by close_date descending (most recent first)
-    history.sort(key=lambda s: (
-        0 if s["status"] == "active" else 1,
-        s.get("close_date") or s.get("open_date") or "",
-    ), reverse=False)
-    # Reverse within each group: active newest first, closed newest first
-    active_sigs = [s for s in history if s["status"] == "active"]
-    closed_sigs = [s for s in history if s["status"] == "closed"]
-    active_sigs.sort(key=lambda s: s.get("open_date", ""), reverse=True)
-    closed_sigs.sort(key=lambda s: s.get("close_date", ""), reverse=True)
-    history = active_sigs + closed_sigs
-
-    active = [s for s in history if s["status"] == "active"]
-    closed = [s for s in history if s["status"] == "closed"]
-    wins = [s for s in closed if s.get("return_vs_spy", 0) > 0]
-    print(f"  Backfill: {len(history)} signals ({len(active)} active, "
-          f"{len(closed)} closed, {len(wins)}/{len(closed)} wins)")
+def _sector_detail_job(args):
+    """Process-pool entry point for compute_sector_detail."""
+    return compute_sector_detail(*args)
 
-    return history
 
+def update_signal_history(result, data_all, history_path, phase_lookup, history=None):
+    """Track signals: open on Accélération entry, close on Confirmé or failure.
 
-def update_signal_history(result, data_all, history_path):
-    """Track signals: open on Accélération entry, close on Confirmé or failure."""
-    history = []
-    if history_path.exists():
-        with open(history_path) as f:
+    `phase_lookup` maps stock id -> current momentum phase (from the sector
+    details main() just computed). `history` is the signal list already read
+    from `history_path`, if the caller has it (it is updated in place).
+    """
+    if history is None:
+        history = []
+        if history_path.exists():
             try:
-                history = json.load(f)
+                history = _read_json(history_path)
             except json.JSONDecodeError:
                 history = []
 
     today = result["metadata"]["date"]
+    today_dt = datetime.strptime(today, "%Y-%m-%d")  # parsed once, not per signal
+    today_ord = today_dt.toordinal()
+    open_ords = {}  # open_date -> day ordinal; signals opened together share a parse
     close = data_all["Close"]
-    spy_close = float(close[BENCHMARK].iloc[-1])
-
-    # Build phase lookup from current signals + sector detail files
-    phase_lookup = {}
-    sectors_dir = history_path.parent / "sectors"
-    for etf in SECTOR_ETFS:
-        sector_file = sectors_dir / f"{etf}.json"
-        if sector_file.exists():
-            with open(sector_file) as f:
-                sector_data = json.load(f)
-            for s in sector_data["stocks"]:
-                phase_lookup[s["id"]] = s["momentum_phase"]
+    last_close = close.iloc[-1].to_dict()  # one row read; per-ticker lookups are dict hits
+    spy_close = float(last_close[BENCHMARK])
 
     # Update existing active signals
     for sig in history:
@@ -1255,16 +1765,19 @@ def update_signal_history(result, data_all, history_path):
             continue
 
         ticker = sig["ticker"]
-        if ticker not in close.columns or np.isnan(close[ticker].iloc[-1]):
+        if ticker not in last_close or np.isnan(last_close[ticker]):
             continue
 
-        current_price = float(close[ticker].iloc[-1])
+        current_price = float(last_close[ticker])
         stock_return = current_price / sig["open_price"] - 1
         spy_return = spy_close / sig["spy_open_price"] - 1
         sig["return_vs_spy"] = round(stock_return - spy_return, 5)
         sig["return_abs"] = round(stock_return, 5)
         sig["current_phase"] = phase_lookup.get(ticker, sig.get("current_phase", "improving"))
-        sig["days_active"] = (datetime.strptime(today, "%Y-%m-%d") - datetime.strptime(sig["open_date"], "%Y-%m-%d")).days
+        open_ord = open_ords.get(sig["open_date"])
+        if open_ord is None:
+            open_ord = open_ords[sig["open_date"]] = datetime.fromisoformat(sig["open_date"]).toordinal()
+        sig["days_active"] = today_ord - open_ord
 
         # Close conditions
         if sig["current_phase"] == "leading":
@@ -1282,6 +1795,7 @@ def update_signal_history(result, data_all, history_path):
 
     # Find new signals: stocks entering improving with strong momentum (RS-Mom >= 101)
     existing_active = {s["ticker"] for s in history if s["status"] == "active"}
+    new_signals = []
     for sig in result.get("signals", []):
         if sig["phase"] != "improving" or sig["days_in_phase"] > 2:
             continue
@@ -1290,23 +1804,24 @@ def update_signal_history(result, data_all, history_path):
         ticker = sig["ticker"]
         if ticker in existing_active:
             continue
-        if ticker not in close.columns or np.isnan(close[ticker].iloc[-1]):
+        if ticker not in last_close or np.isnan(last_close[ticker]):
             continue
-
-        rsi_val = 50.0
-        c = close[ticker].dropna()
-        if len(c) >= 14:
-            rsi_s = compute_rsi_series(c)
-            rv = rsi_s.iloc[-1]
-            if not np.isnan(rv):
-                rsi_val = round(float(rv), 0)
-
+        new_signals.append(sig)
+
+    # RSI at today's close (the last row: every new signal has a price) for
+    # all of their stocks in one batch
+    new_tickers = [sig["ticker"] for sig in new_signals]
+    rsi_now = (compute_rsi_batch(close[new_tickers].to_numpy(dtype=np.float64))[-1].tolist()
+               if new_tickers else [])
+    for sig, rv in zip(new_signals, rsi_now):
+        ticker = sig["ticker"]
+        rsi_val = round(rv, 0) if rv == rv else 50.0
         history.append({
             "ticker": ticker,
             "sector": sig["sector"],
             "sector_name": sig["sector_name"],
             "open_date": today,
-            "open_price": float(close[ticker].iloc[-1]),
+            "open_price": float(last_close[ticker]),
             "spy_open_price": spy_close,
             "current_phase": "improving",
             "days_active": 0,
@@ -1319,18 +1834,12 @@ def update_signal_history(result, data_all, history_path):
         })
 
     # Purge signals older than 60 days (keep active regardless)
-    cutoff = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=60)).strftime("%Y-%m-%d")
+    cutoff = (today_dt - timedelta(days=60)).strftime("%Y-%m-%d")
     history = [s for s in history if s["status"] == "active" or s["open_date"] >= cutoff]
 
-    # Sort: active first (newest first), then closed by close_date descending (most recent first)
-    active_sigs = [s for s in history if s["status"] == "active"]
-    closed_sigs = [s for s in history if s["status"] == "closed"]
-    active_sigs.sort(key=lambda s: s.get("open_date", ""), reverse=True)
-    closed_sigs.sort(key=lambda s: s.get("close_date", ""), reverse=True)
-    history = active_sigs + closed_sigs
+    history = _order_history(history)
 
-    with open(history_path, "w") as f:
-        json.dump(history, f, indent=2)
+    _write_json(history_path, history, indent=True)
 
     return history
 
@@ -1356,19 +1865,9 @@ def main():
         data_all = None
         data_etf = None
     else:
-        global pd, yf
-        import shutil as _shutil
-        # Clear yfinance cache on both macOS and Linux
-        for _cache_dir in [
-            os.path.expanduser("~/Library/Caches/py-yfinance"),  # macOS
-            os.path.expanduser("~/.cache/py-yfinance"),          # Linux
-        ]:
-            if os.path.exists(_cache_dir):
-                _shutil.rmtree(_cache_dir)
-                print(f"Cleared yfinance cache: {_cache_dir}")
-        import pandas as _pd
+        global yf
+        _require_pandas()
         import yfinance as _yf
-        pd = _pd
         yf = _yf
 
         # Disable yfinance SQLite cache to avoid 'database is locked' errors
@@ -1377,52 +1876,61 @@ def main():
         except Exception:
             pass
 
-        # Fetch sector ETFs + benchmark
-        data_etf = fetch_ohlcv()
-        print("Computing rotation signals...")
-        result = detect_rotations(data_etf)
-
         # Get all S&P 500 tickers (scrape Wikipedia, fallback to cache/hardcoded)
         active_holdings = get_sp500_tickers()
-        all_holdings = []
-        for h_list in active_holdings.values():
-            all_holdings.extend(h_list)
-        all_holdings = list(set(all_holdings))
-
-        # Download in batches of 50 (like sp500-patterns)
-        print(f"Downloading {len(all_holdings)} individual stocks for sector detail...")
-        batch_size = 50
-        all_stock_dfs = []
-        for i in range(0, len(all_holdings), batch_size):
-            batch = all_holdings[i:i+batch_size]
-            print(f"  Batch {i//batch_size + 1}/{(len(all_holdings)-1)//batch_size + 1}: {len(batch)} tickers...")
-            batch_data = _download_with_retry(batch, period="2y")
-            all_stock_dfs.append(batch_data)
-        # Merge all batches using concat on the top-level MultiIndex
-        data_stocks = _pd.concat(all_stock_dfs, axis=1)
-        # Remove duplicate columns
-        data_stocks = data_stocks.loc[:, ~data_stocks.columns.duplicated()]
-
-        # Merge sector ETF data + stock data
-        data_all = {}
-        for field in ["Close", "High", "Low", "Volume"]:
-            sector_df = data_etf[field]
-            stock_df = data_stocks[field] if field in data_stocks else _pd.DataFrame()
-            data_all[field] = _pd.concat([sector_df, stock_df], axis=1)
-            # Remove duplicate columns
-            data_all[field] = data_all[field].loc[:, ~data_all[field].columns.duplicated()]
+        all_holdings = sorted({t for h_list in active_holdings.values() for t in h_list})
+
+        # One download for the sector ETFs, the benchmark and every holding
+        data_full = fetch_ohlcv(extra_tickers=all_holdings)
+
+        # ETF/benchmark columns first, then the stocks. Prices stay float64:
+        # float32 closes already move published values (2-decimal closes, RS
+        # and CMF roundings, phases near RS 100).
+        etf_set = set(ETF_TICKERS)
+        columns = list(dict.fromkeys(data_full["Close"].columns))
+        etf_cols = [t for t in columns if t in etf_set]
+        cols = etf_cols + [t for t in columns if t not in etf_set]
+        data_all = {field: data_full[field][cols] for field in ["Close", "High", "Low", "Volume"]}
+        # The ETF view keeps only the days the ETFs traded, as their own download did
+        etf_days = data_all["Close"][etf_cols].notna().any(axis=1).to_numpy()
+        data_etf = {field: frame.loc[etf_days, etf_cols] for field, frame in data_all.items()}
+
+        print("Computing rotation signals...")
+        sector_rs = compute_sector_rs(data_etf)
+        result = detect_rotations(data_etf, sector_rs)
 
     # Generate sector detail files + collect signals
     signals = []
+    phase_lookup = {}  # stock id -> momentum phase, for the signal history update
     if data_all is not None:
         sectors_dir = output_path.parent / "sectors"
         sectors_dir.mkdir(exist_ok=True)
-        for etf in SECTOR_ETFS:
-            detail = compute_sector_detail(etf, data_all, active_holdings)
+        # Sectors are independent: one process each (up to the core count), fed
+        # only the columns they read; writes and signal collection stay here
+        holdings_rs = compute_holdings_rs(data_all, active_holdings)
+        jobs = {etf: _sector_detail_inputs(etf, data_all, active_holdings, holdings_rs)
+                for etf in SECTOR_ORDER}
+        workers = min(len(jobs), os.cpu_count() or 1)
+        if workers > 1:
+            # Largest sectors first, so the longest jobs do not start last
+            by_size = sorted(jobs, key=lambda etf: -len(active_holdings.get(etf, [])))
+            # Forked workers start with pandas/NumPy/yfinance already imported
+            # (Python 3.14 moves the Linux default to forkserver)
+            ctx = multiprocessing.get_context("fork") if sys.platform == "linux" else None
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                done = dict(zip(by_size, pool.map(_sector_detail_job, [jobs[e] for e in by_size])))
+            details = [done[etf] for etf in SECTOR_ORDER]
+        else:
+            details = map(_sector_detail_job, jobs.values())
+        # Detail files are encoded and written on a few threads (orjson and file
+        # I/O release the GIL) while signals are collected here
+        writer = ThreadPoolExecutor(max_workers=4)
+        written = []
+        for etf, detail in zip(SECTOR_ORDER, details):
             if detail:
-                with open(sectors_dir / f"{etf}.json", "w") as f:
-                    json.dump(detail, f, indent=2)
+                written.append(writer.submit(_write_json, sectors_dir / f"{etf}.json", detail, True))
                 print(f"  {etf}: {len(detail['stocks'])} stocks")
+                phase_lookup.update((s["id"], s["momentum_phase"]) for s in detail["stocks"])
 
                 # Collect fresh signals (days_in_phase <= 5)
                 sector_name = SECTOR_ETFS[etf]["name"]
@@ -1444,6 +1952,9 @@ def main():
                         })
             else:
                 print(f"  {etf}: no data")
+        writer.shutdown()
+        for w in written:
+            w.result()  # re-raise any write error
 
     # Sort signals: improving first, then by days_in_phase
     signals.sort(key=lambda s: (0 if s["phase"] == "improving" else 1, s["days_in_phase"]))
@@ -1457,8 +1968,7 @@ def main():
         needs_backfill = not history_path.exists()
         if not needs_backfill:
             try:
-                with open(history_path) as f:
-                    existing = json.load(f)
+                existing = _read_json(history_path)
                 needs_backfill = len(existing) == 0 or all(
                     s.get("days_active", 0) == 0 for s in existing
                 )
@@ -1467,20 +1977,18 @@ def main():
 
         if needs_backfill:
             print("  Backfilling signal history from 2 years of data...")
-            history = backfill_signal_history(data_all, active_holdings)
-            with open(history_path, "w") as f:
-                json.dump(history, f, indent=2)
+            history = backfill_signal_history(data_all, active_holdings, holdings_rs)
+            _write_json(history_path, history, indent=True)
         else:
-            history = update_signal_history(result, data_all, history_path)
-            active = [s for s in history if s["status"] == "active"]
-            closed = [s for s in history if s["status"] == "closed"]
-            wins = [s for s in closed if s.get("return_vs_spy", 0) > 0]
+            history = update_signal_history(result, data_all, history_path, phase_lookup,
+                                            existing)
+            active, closed = _split_status(history)
+            n_wins = sum(s.get("return_vs_spy", 0) > 0 for s in closed)
             print(f"  Signal history: {len(active)} active, {len(closed)} closed "
-                  f"({len(wins)}/{len(closed)} wins)")
+                  f"({n_wins}/{len(closed)} wins)")
 
-        # Load final history for output
-        with open(history_path) as f:
-            result["signals_history"] = json.load(f)
+        # Final history for output (as just written, no need to read it back)
+        result["signals_history"] = history
     else:
         result["signals_history"] = []
 
@@ -1490,33 +1998,26 @@ def main():
         stock_histories = generate_stock_history(data_all, days=252, sector_holdings=active_holdings)
         for etf, sh in stock_histories.items():
             sh_path = sectors_dir / f"{etf}_history.json"
-            with open(sh_path, "w") as f:
-                json.dump(sh, f)
+            _write_json(sh_path, sh)
             print(f"  {etf}: {len(sh['stocks'])} stocks, {len(sh['dates'])} days")
 
     # Generate sector history for RRG playback
     rrg_history_path = output_path.parent / "history.json"
     if data_etf is not None:
         print("Generating sector history for RRG playback...")
-        rrg_history = generate_sector_history(data_etf, days=252)
-        with open(rrg_history_path, "w") as f:
-            json.dump(rrg_history, f)
+        rrg_history = generate_sector_history(data_etf, days=252, sector_rs=sector_rs)
+        _write_json(rrg_history_path, rrg_history)
         print(f"  History: {len(rrg_history['dates'])} days, {len(rrg_history['sectors'])} sectors")
     else:
         # Sample mode
         rrg_history = _generate_sample_history(days=90)
-        with open(rrg_history_path, "w") as f:
-            json.dump(rrg_history, f)
+        _write_json(rrg_history_path, rrg_history)
 
     # Re-write with signals included
-    with open(output_path, "w") as f:
-        json.dump(result, f, indent=2)
-
+    # latest.json stays indented for humans; data.js is only read by the browser
+    _write_json(output_path, result, indent=True)
     js_path = output_path.parent / "data.js"
-    with open(js_path, "w") as f:
-        f.write("window.ROTATION_DATA = ")
-        json.dump(result, f, indent=2)
-        f.write(";\n")
+    _write_atomic(js_path, b"window.ROTATION_DATA = ", _json_bytes(result), b";\n")
 
     meta = result["metadata"]
     print(f"\nDone! {meta['date']}")
@@ -1526,10 +2027,8 @@ def main():
     print(f"  Output: {output_path}")
 
     # Validate data freshness (fail CI if data is stale)
-    if not args.sample and rrg_history_path.exists():
-        with open(rrg_history_path) as f:
-            h = json.load(f)
-        last_date = h["dates"][-1] if h.get("dates") else None
+    if not args.sample:
+        last_date = rrg_history["dates"][-1] if rrg_history.get("dates") else None
         if last_date:
             from datetime import date
             data_date = date.fromisoformat(last_date)